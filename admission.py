@@ -0,0 +1,101 @@
+import asyncio
+import contextvars
+import functools
+from collections import deque
+
+import metrics
+
+SHED = metrics.Counter("db_admission_shed_total", "Database calls rejected by admission control",
+                       ("function", "reason"))
+QUEUE_WAIT = metrics.Histogram("db_admission_wait_seconds", "Time database calls waited for an admission slot")
+
+
+class Overloaded(Exception):
+    """Raised when a database call is shed instead of queued behind a saturated database"""
+
+
+class AdmissionController:
+    """Caps the database calls one worker has in flight and sheds the ones that wait too long.
+
+    Up to ``limit`` calls run at once. Later calls queue for at most
+    ``queue_timeout`` seconds, and no more than ``max_waiting`` of them may
+    queue at all; anything beyond that raises Overloaded straight away so
+    the webhook can answer before Dialogflow gives up on it. Must be used
+    from the event loop thread.
+    """
+
+    def __init__(self, limit, queue_timeout=1.0, max_waiting=None, shed=SHED, wait=QUEUE_WAIT):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_waiting = limit * 4 if max_waiting is None else max_waiting
+        self.in_flight = 0
+        self._waiters = deque()
+        # Counter labelled (function, reason) and histogram of seconds spent queued
+        self._shed = shed
+        self._wait = wait
+
+    @property
+    def waiting(self):
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self, name):
+        """Take a slot for the call ``name``, or raise Overloaded"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        if self.waiting >= self.max_waiting:
+            self._shed.inc(name, "queue_full")
+            raise Overloaded(f"{name}: {self.max_waiting} database calls already queued")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed.inc(name, "deadline")
+            raise Overloaded(f"{name}: no database slot within {self.queue_timeout:.2f}s") from None
+        except BaseException:
+            # Cancelled right after release() handed this waiter the slot
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            self._wait.observe(asyncio.get_running_loop().time() - started)
+
+    async def run(self, executor, func, *args, **kwargs):
+        """Take a slot, run ``func`` on ``executor`` with the caller's context variables and await it.
+
+        The slot is held until the thread is done, even if the awaiting
+        request is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        await self.acquire(getattr(func, "__name__", "call"))
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, func, *args, **kwargs)
+        try:
+            future = executor.submit(call)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release_threadsafe(loop))
+        return await asyncio.wrap_future(future)
+
+    def release_threadsafe(self, loop):
+        """release() from a worker thread, on ``loop``"""
+        try:
+            loop.call_soon_threadsafe(self.release)
+        except RuntimeError:
+            # The loop is gone; nobody is left waiting for a slot
+            self.release()
+
+    def release(self):
+        """Give the slot to the oldest live waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
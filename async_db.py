@@ -0,0 +1,92 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import db_helper
+import metrics
+import reservation_engine
+import sales
+from admission import AdmissionController, Overloaded
+
+# One thread per pooled connection: more threads would only queue on the pool
+MAX_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(db_helper.POOL_SIZE)))
+# Calls allowed in flight per worker process, and how long a call may queue for one of those slots
+MAX_IN_FLIGHT = int(os.getenv("DB_MAX_IN_FLIGHT", str(MAX_WORKERS)))
+QUEUE_TIMEOUT = float(os.getenv("DB_QUEUE_TIMEOUT", "1.0"))
+MAX_WAITING = int(os.getenv("DB_MAX_WAITING", str(MAX_IN_FLIGHT * 4)))
+
+_executor = None
+admission = AdmissionController(MAX_IN_FLIGHT, queue_timeout=QUEUE_TIMEOUT, max_waiting=MAX_WAITING)
+
+metrics.Gauge("db_admission_in_flight", "Database calls holding an admission slot", lambda: admission.in_flight)
+metrics.Gauge("db_admission_waiting", "Database calls queued for an admission slot", lambda: admission.waiting)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="db")
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking db_helper call on the database executor and await its result.
+
+    The call first waits for an admission slot and raises Overloaded when
+    none frees up in time. The caller's context variables are carried into
+    the worker thread.
+    """
+    return await admission.run(_get_executor(), func, *args, **kwargs)
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def _wrap(func, fallback=None):
+    """Async version of ``func``; when shed, ``fallback(*args)`` answers instead if it returns a value"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await run(func, *args, **kwargs)
+        except Overloaded:
+            cached = fallback(*args, **kwargs) if fallback is not None else None
+            if cached is None:
+                raise
+            return cached
+    return wrapper
+
+
+_price_order = _wrap(db_helper.price_order)
+_get_next_order_id = _wrap(db_helper.get_next_order_id)
+
+
+# price_order and get_next_order_id are usually answered from memory. They only take the executor
+# and an admission slot when the menu cache has to be reloaded or a new block of IDs reserved
+async def price_order(order_dict):
+    if db_helper.menu_cache.stale:
+        return await _price_order(order_dict)
+    return db_helper.price_order(order_dict, refresh=False)
+
+
+async def get_next_order_id():
+    order_id = db_helper.order_id_allocator.next_id_nowait()
+    if order_id is None:
+        return await _get_next_order_id()
+    return order_id
+
+
+get_order_status = _wrap(db_helper.get_order_status, fallback=db_helper.last_known_order_status)
+transition_order_status = _wrap(db_helper.transition_order_status)
+debug_order_tables = _wrap(db_helper.debug_order_tables)
+register_user = _wrap(db_helper.register_user)
+book_reservation = _wrap(reservation_engine.engine.book_reservation)
+get_reservation = _wrap(db_helper.get_reservation, fallback=db_helper.last_known_reservation)
+cancel_reservation = _wrap(reservation_engine.engine.cancel_reservation)
+refresh_menu = _wrap(db_helper.menu_cache.refresh)
+sales_summary = _wrap(sales.sales_summary)
+warm_up = _wrap(db_helper.warm_up)
+check_database = _wrap(db_helper.check_database)
@@ -0,0 +1,336 @@
+"""Replay Dialogflow webhook traffic against the chatbot and report latency per intent.
+
+By default the FastAPI app is driven in-process through ASGI, so no server is
+needed; pass --url to target a running uvicorn instead. Sessions are either
+synthesized (add/remove/complete/track plus reservation turns) or replayed
+from a JSONL file of webhook payloads given with --payloads.
+
+In-process runs default to a throwaway embedded SQLite database seeded with
+a fixed menu, so they need no MySQL server. Pass --backend mysql to use the
+database configured through DB_* instead, adding --seed to migrate the schema
+and menu there first.
+
+    python benchmarks/replay.py --sessions 200 --concurrency 20
+    python benchmarks/replay.py --backend mysql --seed
+    python benchmarks/replay.py --save-baseline benchmarks/baseline.json
+    python benchmarks/replay.py --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MENU = [("Pizza", 8.00), ("Samosa", 2.50), ("Biryani", 6.50), ("Mango Lassi", 3.00),
+        ("Pav Bhaji", 5.00), ("Vada Pav", 2.00), ("Chole Bhature", 5.50), ("Masala Dosa", 4.50)]
+
+ADD = "order.add - context: ongoing-order"
+REMOVE = "order.remove - context: ongoing-order"
+COMPLETE = "order.complete - context: ongoing-order"
+TRACK = "track.order - context: ongoing-tracking"
+BOOK = "book_reservation"
+CHECK = "check_reservation"
+CANCEL_RESERVATION = "cancel_reservation"
+
+ORDER_ID = re.compile(r"Order ID: #(\d+)")
+RESERVATION_ID = re.compile(r"reservation ID is (\d+)")
+FAILURE = re.compile(r"error|couldn't|could not|failed|unable|oops|sorry", re.IGNORECASE)
+
+
+def make_payload(intent, parameters, session, turn):
+    return {
+        "responseId": f"{session}-{turn}",
+        "session": f"projects/bench/agent/sessions/{session}",
+        "queryResult": {
+            "intent": {"displayName": intent},
+            "parameters": parameters,
+            "outputContexts": [{"name": f"projects/bench/agent/sessions/{session}/contexts/ongoing-order"}],
+        },
+    }
+
+
+def synthesize_session(rng, session):
+    """Yield (intent, parameters) turns; later turns read IDs from earlier responses via the state dict"""
+    if rng.random() < 0.75:
+        cart = []
+        for _ in range(rng.randint(1, 3)):
+            items = rng.sample(MENU, rng.randint(1, 2))
+            cart.extend(name for name, _ in items)
+            yield ADD, {"food-item": [name for name, _ in items], "number": [rng.randint(1, 3) for _ in items]}
+        if rng.random() < 0.3:
+            yield REMOVE, {"food-item": [rng.choice(cart)]}
+        yield COMPLETE, {}
+        for _ in range(rng.randint(0, 2)):
+            yield TRACK, lambda state: {"number": state.get("order_id", 0)}
+    else:
+        day = date.today() + timedelta(days=rng.randint(1, 14))
+        hour = rng.choice([12, 13, 19, 20, 21])
+        yield BOOK, {"given-name": f"Guest {session[-4:]}", "date": f"{day.isoformat()}T12:00:00+05:00",
+                     "time": f"{day.isoformat()}T{hour}:00:00+05:00", "number": rng.randint(1, 6)}
+        yield CHECK, lambda state: {"id": state.get("reservation_id", 0)}
+        if rng.random() < 0.3:
+            yield CANCEL_RESERVATION, lambda state: {"id": state.get("reservation_id", 0)}
+
+
+def load_payloads(path):
+    """Group replayed payloads by session so each session's turns stay in order"""
+    sessions = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            payload = payload.get("payload", payload)
+            contexts = payload.get("queryResult", {}).get("outputContexts") or [{"name": ""}]
+            match = re.search(r"/sessions/([^/]+)", contexts[0].get("name", ""))
+            sessions[match.group(1) if match else ""].append(payload)
+    return list(sessions.values())
+
+
+class AsgiClient:
+    """Minimal in-process HTTP client for an ASGI app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def post(self, path, body: bytes):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                         (b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = None
+        chunks = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class HttpClient:
+    """Blocking HTTP client run on worker threads, for benchmarking a live server"""
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.base = parsed.path.rstrip("/")
+
+    async def post(self, path, body: bytes):
+        return await asyncio.to_thread(self._post, path, body)
+
+    def _post(self, path, body):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request("POST", self.base + path, body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+
+async def run_session(client, turns, session, latencies, errors):
+    state = {}
+    for turn, item in enumerate(turns):
+        if isinstance(item, dict):
+            payload = item
+            intent = payload["queryResult"]["intent"]["displayName"]
+        else:
+            intent, parameters = item
+            if callable(parameters):
+                parameters = parameters(state)
+            payload = make_payload(intent, parameters, session, turn)
+
+        start = time.perf_counter()
+        status, body = await client.post("/", json.dumps(payload).encode())
+        latencies[intent].append(time.perf_counter() - start)
+
+        text = ""
+        if status == 200:
+            text = json.loads(body).get("fulfillmentText", "")
+        if status != 200 or FAILURE.search(text):
+            errors[intent] += 1
+        for key, pattern in (("order_id", ORDER_ID), ("reservation_id", RESERVATION_ID)):
+            match = pattern.search(text)
+            if match:
+                state[key] = int(match.group(1))
+
+
+async def run_benchmark(client, sessions, concurrency):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    queue = asyncio.Queue()
+    for item in sessions:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            session, turns = queue.get_nowait()
+            await run_session(client, turns, session, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, elapsed):
+    summary = {"elapsed_seconds": elapsed, "intents": {}}
+    total = 0
+    for intent, values in sorted(latencies.items()):
+        total += len(values)
+        summary["intents"][intent] = {
+            "requests": len(values),
+            "errors": errors[intent],
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+    summary["requests"] = total
+    summary["throughput_rps"] = total / elapsed if elapsed else 0.0
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'intent':<42}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for intent, row in summary["intents"].items():
+        print(f"{intent:<42}{row['requests']:>7}{row['errors']:>6}{row['throughput_rps']:>9.1f}"
+              f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}")
+    print(f"total {summary['requests']} requests in {summary['elapsed_seconds']:.2f}s "
+          f"({summary['throughput_rps']:.1f} req/s)")
+
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """Return a message for every intent whose p95 latency or throughput regressed beyond ``tolerance``"""
+    regressions = []
+    for intent, row in summary["intents"].items():
+        base = baseline["intents"].get(intent)
+        if not base:
+            continue
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{intent}: p95 {row['p95_ms']:.2f}ms vs baseline {base['p95_ms']:.2f}ms")
+        if row["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{intent}: {row['throughput_rps']:.1f} req/s "
+                               f"vs baseline {base['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def seed_database():
+    """Create the schema and load the benchmark menu"""
+    import db_helper
+    import schema
+
+    schema.migrate()
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            for item_id, (name, price) in enumerate(MENU, start=1):
+                cursor.execute("REPLACE INTO food_items (item_id, name, price) VALUES (%s, %s, %s)",
+                               (item_id, name, price))
+        cnx.commit()
+    db_helper.menu_cache.invalidate()
+
+
+def use_backend(backend):
+    """Point the in-process app at ``backend``; returns True when it is a fresh database that needs seeding.
+
+    Must run before db_helper is imported.
+    """
+    os.environ["DB_BACKEND"] = backend
+    if backend != "sqlite":
+        return False
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["ORDER_QUEUE_PATH"] = os.path.join(workdir, "order_queue.db")
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+    return True
+
+
+async def main_async(args):
+    rng = random.Random(args.seed_value)
+    if args.payloads:
+        sessions = [(f"replay-{i}", turns) for i, turns in enumerate(load_payloads(args.payloads))]
+    else:
+        sessions = []
+        for i in range(args.sessions):
+            session = f"bench-{i:06d}"
+            sessions.append((session, list(synthesize_session(rng, session))))
+
+    if args.url:
+        return await run_benchmark(HttpClient(args.url), sessions, args.concurrency)
+
+    if args.seed:
+        seed_database()
+    import main
+    async with main.app.router.lifespan_context(main.app):
+        return await run_benchmark(AsgiClient(main.app), sessions, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--payloads", help="JSONL file of Dialogflow webhook payloads to replay")
+    parser.add_argument("--sessions", type=int, default=100, help="synthetic sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions in flight at once")
+    parser.add_argument("--seed-value", type=int, default=1, help="random seed for synthetic sessions")
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite",
+                        help="database for in-process runs (default: throwaway SQLite)")
+    parser.add_argument("--seed", action="store_true", help="create tables and load the menu first")
+    parser.add_argument("--output", help="write the JSON summary to this file")
+    parser.add_argument("--save-baseline", help="store this run as the baseline")
+    parser.add_argument("--baseline", help="compare against a stored baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if not args.url and use_backend(args.backend):
+        args.seed = True
+
+    latencies, errors, elapsed = asyncio.run(main_async(args))
+    summary = summarize(latencies, errors, elapsed)
+    print_summary(summary)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(summary, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark /register throughput while watching event loop responsiveness.
+
+Signups are posted in-process through ASGI at a fixed concurrency while a
+probe task sleeps in short ticks and records how late each wakeup is. With
+hashing on the KDF pool the loop stays responsive; --inline hashes on the
+event loop instead, for comparison.
+
+    python benchmarks/signup.py --signups 200 --concurrency 20
+    python benchmarks/signup.py --signups 200 --concurrency 20 --inline
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from replay import AsgiClient, percentile, use_backend  # noqa: E402
+
+PROBE_INTERVAL = 0.005
+
+
+async def probe(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run(args):
+    import main
+    import passwords
+
+    if args.inline:
+        async def hash_inline(password):
+            return passwords.hash_password_sync(password)
+        passwords.hash_password = hash_inline
+
+    client = AsgiClient(main.app)
+    queue = asyncio.Queue()
+    for i in range(args.signups):
+        queue.put_nowait(i)
+    failures = 0
+    latencies = []
+
+    async def worker():
+        nonlocal failures
+        while not queue.empty():
+            i = queue.get_nowait()
+            body = json.dumps({"username": f"user{i}", "email": f"user{i}@example.com",
+                               "password": f"correct horse {i}"}).encode()
+            start = time.perf_counter()
+            status, response = await client.post("/register", body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200 or "message" not in json.loads(response):
+                failures += 1
+
+    async with main.app.router.lifespan_context(main.app):
+        lags, stop = [], asyncio.Event()
+        probe_task = asyncio.create_task(probe(lags, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+    return elapsed, latencies, failures, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--signups", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop, as before the KDF pool")
+    args = parser.parse_args()
+
+    if use_backend(args.backend):
+        import schema
+        schema.migrate()
+
+    elapsed, latencies, failures, lags = asyncio.run(run(args))
+    print(f"{args.signups} signups in {elapsed:.2f}s ({args.signups / elapsed:.1f}/s), {failures} failed, "
+          f"{'inline' if args.inline else 'KDF pool'} hashing")
+    print(f"signup latency p50 {percentile(latencies, 50) * 1000:.1f}ms  p99 {percentile(latencies, 99) * 1000:.1f}ms")
+    print(f"event loop lag  p50 {percentile(lags, 50) * 1000:.1f}ms  p99 {percentile(lags, 99) * 1000:.1f}ms  "
+          f"max {max(lags) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,214 +1,508 @@
-import mysql.connector
 import logging
-from datetime import datetime
-from typing import Optional, Tuple
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+import metrics
+import profiling
+import statements
+import storage
+from db_pool import ConnectionPool, PoolTimeout
+from id_allocator import BlockIdAllocator
+from menu_cache import MenuCache
+from ttl_cache import TTLCache
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", "3306")),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "root"),
+    "database": os.getenv("DB_NAME", "mr_ray"),
+}
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Connections opened at startup so the first requests skip the connect handshake
+POOL_MIN_IDLE = int(os.getenv("DB_POOL_MIN_IDLE", "2"))
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "300"))
+ORDER_ID_BLOCK_SIZE = int(os.getenv("ORDER_ID_BLOCK_SIZE", "20"))
+ORDER_STATUS_CACHE_TTL = float(os.getenv("ORDER_STATUS_CACHE_TTL", "15"))
+# Rows fetched per round trip by the export streams
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+# How long last-seen rows may answer read-only intents while the database is shedding load
+FALLBACK_CACHE_TTL = float(os.getenv("FALLBACK_CACHE_TTL", "3600"))
+
+# Selected with DB_BACKEND: "mysql" (default) or the embedded "sqlite" at SQLITE_PATH
+backend = storage.create_backend(storage.DB_BACKEND, DB_CONFIG)
+
+# Errors every helper treats as a failed database call
+DB_ERRORS = backend.errors + (PoolTimeout, storage.StorageError)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(backend.connect, backend.ping, size=POOL_SIZE,
+                                       checkout_timeout=POOL_CHECKOUT_TIMEOUT, recycle=POOL_RECYCLE,
+                                       on_checkout=metrics.POOL_WAIT.observe)
+    return _pool
+
+
+metrics.Gauge("db_pool_connections_in_use", "Pooled connections currently checked out",
+              lambda: get_pool().stats()["in_use"])
+metrics.Gauge("db_pool_connections_open", "Connections currently held by the pool",
+              lambda: get_pool().stats()["opened"])
+
+
+@contextmanager
 def get_db_connection():
+    """Check out a pooled connection for the duration of the ``with`` block.
+
+    Any transaction still open when the block exits is rolled back, so callers
+    only need to commit. Connections that fail during the block are discarded
+    instead of being returned to the pool.
+    """
+    pool = get_pool()
+    pooled = pool.acquire()
+    cnx = pooled.raw
     try:
-        logger.info("Establishing new database connection")
-        return mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="root",
-            database="mr_ray",
-            autocommit=False
-        )
-    except mysql.connector.Error as err:
-        logger.error(f"Database connection failed: {err}")
+        yield profiling.traced_connection(cnx)
+    except BaseException:
+        _release(pool, pooled, failed=True)
         raise
+    else:
+        _release(pool, pooled)
 
 
-def insert_order_item(order_id, food_item, quantity):
+def _release(pool, pooled, failed=False):
+    cnx = pooled.raw
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        # Add your actual insertion logic here
-        cursor.close()
-        cnx.close()
-        return order_id
-    except mysql.connector.Error as err:
-        if 'cnx' in locals(): cnx.close()
-        return -1
+        if failed or cnx.in_transaction:
+            cnx.rollback()
+    except Exception as err:
+        logger.warning("Discarding database connection after failed rollback: %s", err)
+        pool.release(pooled, discard=True)
+        return
+    pool.release(pooled)
+
+
+# Driver connection -> {statement name: prepared cursor}; entries go away with their connection
+_prepared_cursors = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+PREPARED_CACHE = metrics.Counter("db_prepared_statement_cache_total",
+                                 "Registered statement executions, by whether the connection had it prepared",
+                                 ("statement", "result"))
+
+
+def _prepared(cnx, statement):
+    raw = profiling.untraced(cnx)
+    with _prepared_lock:
+        cursors = _prepared_cursors.setdefault(raw, {})
+    cursor = cursors.get(statement.name)
+    if cursor is None:
+        PREPARED_CACHE.inc(statement.name, "miss")
+        cursor = cursors[statement.name] = backend.prepared_cursor(raw, dictionary=statement.dictionary)
+    else:
+        PREPARED_CACHE.inc(statement.name, "hit")
+    return profiling.traced_cursor(cursor)
+
+
+def run_statement(cnx, statement, params=()):
+    """Execute a registered statement on the connection's prepared cursor for it and return the cursor.
+
+    Use query_all/query_one for statements that return rows: prepared cursors
+    are unbuffered, so every row must be read before the next statement.
+    """
+    cursor = _prepared(cnx, statement)
+    cursor.execute(statement.sql, params)
+    return cursor
+
+
+def query_all(cnx, statement, params=()):
+    return run_statement(cnx, statement, params).fetchall()
+
+
+def query_one(cnx, statement, params=()):
+    """First row of a registered query, or None"""
+    rows = query_all(cnx, statement, params)
+    return rows[0] if rows else None
+
+
+def check_database() -> float:
+    """Run a trivial query through the pool and return the seconds it took"""
+    started = time.perf_counter()
+    with get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+    return time.perf_counter() - started
+
+
+@metrics.instrumented
+def load_menu():
+    """Read every food item as (item_id, name, price) rows for the menu cache"""
+    with get_db_connection() as cnx:
+        return query_all(cnx, statements.MENU_ITEMS)
+
+
+menu_cache = MenuCache(load_menu, ttl=MENU_CACHE_TTL)
+
+# Short-lived order_id -> status cache, written through by every status change
+order_status_cache = TTLCache(max_size=10000, ttl=ORDER_STATUS_CACHE_TTL)
+# Longer-lived copies, only read when admission control sheds the database call
+order_status_fallback = TTLCache(max_size=10000, ttl=FALLBACK_CACHE_TTL)
+reservation_fallback = TTLCache(max_size=10000, ttl=FALLBACK_CACHE_TTL)
+
+
+def cache_order_status(order_id, status):
+    order_status_cache.set(order_id, status)
+    order_status_fallback.set(order_id, status)
+
+
+def last_known_order_status(order_id):
+    return order_status_cache.get(order_id) or order_status_fallback.get(order_id)
 
 
-def insert_order_tracking(order_id, status):
+def last_known_reservation(reservation_id):
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("INSERT INTO order_tracking (order_id, status) VALUES (%s, %s)", (order_id, status))
-        cnx.commit()
-        cursor.close()
-        cnx.close()
-    except mysql.connector.Error as err:
-        logger.error(f"Insert order tracking failed: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
+        return reservation_fallback.get(int(reservation_id))
+    except (TypeError, ValueError):
+        return None
+
+
+@metrics.instrumented
+def insert_order_item(order_id, food_item, quantity):
+    try:
+        with get_db_connection() as cnx:
+            with cnx.cursor() as cursor:
+                # Add your actual insertion logic here
+                pass
+        return order_id
+    except DB_ERRORS as err:
+        return -1
 
 
+@metrics.instrumented
 def get_total_order_price(order_id):
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT SUM(total_price) FROM orders WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()[0]
-        cursor.close()
-        cnx.close()
+        with get_db_connection() as cnx:
+            result = query_one(cnx, statements.ORDER_TOTAL, (order_id,))[0]
         return result or 0
-    except mysql.connector.Error as err:
-        logger.error(f"Error fetching total order price: {err}")
-        if 'cnx' in locals(): cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Error fetching total order price: %s", err)
         return None
 
 
+class PricedLine(NamedTuple):
+    item_id: int
+    quantity: int
+    unit_price: object
+    line_total: object
+
+
+class PricedOrder(NamedTuple):
+    lines: Tuple[PricedLine, ...]
+    total: object
+    missing: Tuple[str, ...]
+
+
+@metrics.instrumented
+def price_order(order_dict, refresh=True) -> PricedOrder:
+    """Resolve and price every cart line once, from the menu cache; ``refresh=False`` never reloads it"""
+    quantities = {}
+    prices = {}
+    missing = []
+    for food_item, quantity in order_dict.items():
+        item = menu_cache.lookup(food_item, refresh=refresh)
+        if item:
+            quantities[item.item_id] = quantities.get(item.item_id, 0) + int(quantity)
+            prices[item.item_id] = item.price
+        else:
+            logger.warning("Item not found in menu: %s", food_item)
+            missing.append(food_item)
+
+    lines = tuple(PricedLine(item_id, quantity, prices[item_id], prices[item_id] * quantity)
+                  for item_id, quantity in quantities.items())
+    return PricedOrder(lines, sum(line.line_total for line in lines), tuple(missing))
+
+
 def calculate_order_total(order_dict):
     """Calculate total price for an order dictionary"""
-    try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        total_price = 0
-
-        for food_item, quantity in order_dict.items():
-            cursor.execute("SELECT price FROM food_items WHERE LOWER(name) = LOWER(%s)", (food_item,))
-            result = cursor.fetchone()
-            if result:
-                item_price = result[0]
-                total_price += item_price * int(quantity)
-            else:
-                logger.warning(f"Item not found in menu: {food_item}")
+    return price_order(order_dict).total
+
+
+# Statements whose text depends on a row count are built by these helpers, which
+# schema.HOT_QUERIES also calls to check their query plans
+
+
+def insert_order_lines_sql(rows):
+    return "INSERT INTO orders (order_id, item_id, quantity, total_price) VALUES " + \
+        ", ".join(["(%s, %s, %s, %s)"] * rows)
+
+
+def insert_order_tracking_sql(rows):
+    return "INSERT INTO order_tracking (order_id, status, placed_at) VALUES " + ", ".join(["(%s, %s, %s)"] * rows)
+
+
+def tracked_order_ids_sql(rows):
+    return f"SELECT order_id FROM order_tracking WHERE order_id IN ({', '.join(['%s'] * rows)})"
+
+
+# (table, key columns, counter columns) add_sales upserts into, for placed and for cancelled orders
+SALES_ROLLUPS = {
+    cancelled: (("sales_daily", ("sales_date",), (f"{prefix}orders", f"{prefix}revenue")),
+                ("sales_daily_items", ("sales_date", "item_id"), (f"{prefix}quantity", f"{prefix}revenue")))
+    for cancelled, prefix in ((False, ""), (True, "cancelled_"))
+}
+
+
+@metrics.instrumented
+def insert_order_lines(cursor, orders):
+    """Write the priced lines of every ``(order_id, PricedOrder)`` pair with a single multi-row INSERT"""
+    params = []
+    for order_id, priced_order in orders:
+        for line in priced_order.lines:
+            params.extend((order_id, line.item_id, line.quantity, line.line_total))
+    if not params:
+        return
+    cursor.execute(insert_order_lines_sql(len(params) // 4), params)
+
+
+@metrics.instrumented
+def insert_order_tracking_rows(cursor, orders, status):
+    """Insert one tracking row per ``(order_id, placed_at)`` pair with a single multi-row INSERT"""
+    if not orders:
+        return
+    params = []
+    for order_id, placed_at in orders:
+        params.extend((order_id, status, placed_at))
+    cursor.execute(insert_order_tracking_sql(len(orders)), params)
+
+
+def _accumulate(cursor, table, keys, counters, rows):
+    if rows:
+        cursor.execute(backend.accumulate(table, keys, counters, len(rows)), [value for row in rows for value in row])
+
+
+def _sales_date(placed_at):
+    # SQLite hands DATETIME columns back as ISO strings
+    return (datetime.fromisoformat(placed_at) if isinstance(placed_at, str) else placed_at).date()
+
+
+@metrics.instrumented
+def add_sales(cursor, orders, cancelled=False):
+    """Add ``(placed_at, lines)`` orders to the daily and per-item sales rollups.
+
+    Lines are ``(item_id, quantity, line_total)`` rows. With ``cancelled``
+    the orders are counted as cancelled instead of placed. Orders without
+    lines are not counted, to match rebuild_sales_rollups().
+    """
+    days, items = {}, {}
+    for placed_at, lines in orders:
+        if not lines:
+            continue
+        day = _sales_date(placed_at)
+        count, revenue = days.get(day, (0, 0))
+        days[day] = (count + 1, revenue + sum(line_total for _, _, line_total in lines))
+        for item_id, quantity, line_total in lines:
+            total_quantity, revenue = items.get((day, item_id), (0, 0))
+            items[(day, item_id)] = (total_quantity + quantity, revenue + line_total)
+    daily, per_item = SALES_ROLLUPS[cancelled]
+    _accumulate(cursor, *daily, [(day, count, revenue) for day, (count, revenue) in days.items()])
+    _accumulate(cursor, *per_item,
+                [(day, item_id, quantity, revenue) for (day, item_id), (quantity, revenue) in items.items()])
+
+
+def rebuild_sales_rollups(cursor):
+    """Recompute both sales rollups from orders and order_tracking inside the caller's transaction.
+
+    Orders tracked before placed_at was recorded have no sales date and are left out.
+    """
+    cursor.execute("DELETE FROM sales_daily_items")
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute("""
+        INSERT INTO sales_daily (sales_date, orders, revenue, cancelled_orders, cancelled_revenue)
+        SELECT DATE(t.placed_at), COUNT(*), SUM(o.total),
+               SUM(CASE WHEN t.status = 'cancelled' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN t.status = 'cancelled' THEN o.total ELSE 0 END)
+        FROM order_tracking t
+        JOIN (SELECT order_id, SUM(total_price) AS total FROM orders GROUP BY order_id) o
+          ON o.order_id = t.order_id
+        WHERE t.placed_at IS NOT NULL
+        GROUP BY DATE(t.placed_at)
+    """)
+    cursor.execute("""
+        INSERT INTO sales_daily_items (sales_date, item_id, quantity, revenue, cancelled_quantity, cancelled_revenue)
+        SELECT DATE(t.placed_at), o.item_id, SUM(o.quantity), SUM(o.total_price),
+               SUM(CASE WHEN t.status = 'cancelled' THEN o.quantity ELSE 0 END),
+               SUM(CASE WHEN t.status = 'cancelled' THEN o.total_price ELSE 0 END)
+        FROM order_tracking t JOIN orders o ON o.order_id = t.order_id
+        WHERE t.placed_at IS NOT NULL
+        GROUP BY DATE(t.placed_at), o.item_id
+    """)
+
+
+@metrics.instrumented
+def get_tracked_order_ids(cursor, order_ids):
+    """Return the subset of ``order_ids`` that already have a tracking row"""
+    if not order_ids:
+        return set()
+    cursor.execute(tracked_order_ids_sql(len(order_ids)), list(order_ids))
+    return {row[0] for row in cursor.fetchall()}
+
+
+_sequence_ready = False
+# Seeded from existing orders only when the counter row does not exist yet
+SEED_ORDER_ID_SEQUENCE = f"""
+    {backend.insert_ignore} INTO id_sequences (name, next_value)
+    SELECT 'orders', IFNULL(MAX(order_id), 0) + 1 FROM orders
+"""
+
+
+def _ensure_order_id_sequence(cursor):
+    """Seed the order ID counter (table created by schema.py) once per process"""
+    global _sequence_ready
+    if _sequence_ready:
+        return
+    cursor.execute(SEED_ORDER_ID_SEQUENCE)
+    _sequence_ready = True
+
+
+@metrics.instrumented
+def reserve_order_ids(count):
+    """Atomically reserve ``count`` consecutive order IDs and return the first one"""
+    global _sequence_ready
+    with get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            _ensure_order_id_sequence(cursor)
+            try:
+                next_value = backend.reserve_sequence(cursor, "orders", count)
+            except storage.StorageError:
+                _sequence_ready = False
+                raise
+        cnx.commit()
+    logger.info("Reserved order IDs %s-%s", next_value - count, next_value - 1)
+    return next_value - count
 
-        cursor.close()
-        cnx.close()
-        return total_price
-    except mysql.connector.Error as err:
-        logger.error(f"Error calculating order total: {err}")
-        if 'cnx' in locals(): cnx.close()
-        return 0
+
+order_id_allocator = BlockIdAllocator(reserve_order_ids, block_size=ORDER_ID_BLOCK_SIZE)
 
 
+def warm_up():
+    """Open the minimum idle connections and reserve the first block of order IDs"""
+    opened = get_pool().prefill(POOL_MIN_IDLE)
+    order_id_allocator.prefetch()
+    return opened
+
+
+@metrics.instrumented
 def get_next_order_id():
     """Get the next available order ID"""
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT IFNULL(MAX(order_id), 0) + 1 FROM orders")
-        result = cursor.fetchone()
-        cursor.close()
-        cnx.close()
-
-        if result:
-            next_order_id = result[0]
-            logger.info(f"Next order ID: {next_order_id}")
-            return next_order_id
-        else:
-            logger.info("Starting with order ID: 1")
-            return 1
-
-    except mysql.connector.Error as err:
-        logger.error(f"Error in get_next_order_id: {err}")
-        if 'cnx' in locals(): cnx.close()
+        return order_id_allocator.next_id()
+    except DB_ERRORS as err:
+        logger.error("Error in get_next_order_id: %s", err)
         return None
 
 
+@metrics.instrumented
 def get_order_status(order_id):
+    status = order_status_cache.get(order_id)
+    if status is not None:
+        return status
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-
-        # First check if order exists in orders table
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE order_id = %s", (order_id,))
-        order_exists = cursor.fetchone()[0] > 0
-
-        if not order_exists:
-            logger.info(f"Order {order_id} not found in orders table")
-            cursor.close()
-            cnx.close()
-            return None
-
-        # Then check order_tracking table
-        cursor.execute("SELECT status FROM order_tracking WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        cnx.close()
+        with get_db_connection() as cnx:
+            # Tracking rows are written in the same transaction as the order lines
+            result = query_one(cnx, statements.ORDER_STATUS, (order_id,))
 
         if result:
+            cache_order_status(order_id, result[0])
             return result[0]
-        else:
-            # If order exists but no tracking record, return default status
-            logger.info(f"Order {order_id} exists but no tracking record found")
-            return "in progress"
+        logger.info("Order %s not found in order_tracking table", order_id)
+        return None
 
-    except mysql.connector.Error as err:
-        logger.error(f"Error fetching order status: {err}")
-        if 'cnx' in locals(): cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Error fetching order status: %s", err)
         return None
 
 
-def cancel_order(order_id: int):
-    try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
+# Statuses an order never leaves
+FINAL_ORDER_STATUSES = ("cancelled", "delivered")
+# Status an order may move to -> the statuses it may move from, or None for any status that is not final
+ORDER_TRANSITIONS = {
+    "out for delivery": ("in progress",),
+    "delivered": None,
+    "cancelled": None,
+}
 
-        # Check current status from order_tracking
-        cursor.execute("SELECT status FROM order_tracking WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
 
-        if result:
-            current_status = result[0].lower()
-            if current_status in ['cancelled', 'delivered']:
-                cursor.close()
-                cnx.close()
-                return False
-            # Delete tracking first
-            cursor.execute("DELETE FROM order_tracking WHERE order_id = %s", (order_id,))
-        else:
-            # If no tracking exists, still proceed to delete order
-            pass
+@metrics.instrumented
+def transition_order_status(order_id: int, status: str) -> Optional[bool]:
+    """Move an order to ``status`` with one conditional UPDATE.
 
-        # Now delete from orders table (safe after deleting tracking)
-        cursor.execute("DELETE FROM orders WHERE order_id = %s", (order_id,))
-        cnx.commit()
+    Returns False when the order does not exist or its current status does
+    not allow the change, and None when the database call fails.
+    """
+    if status not in ORDER_TRANSITIONS:
+        raise ValueError(f"Unknown order status: {status}")
+    sources = ORDER_TRANSITIONS[status]
+    try:
+        with get_db_connection() as cnx:
+            if sources is None:
+                cursor = run_statement(cnx, statements.FINISH_ORDER_STATUS, (status, order_id, *FINAL_ORDER_STATUSES))
+            else:
+                cursor = run_statement(cnx, statements.TRANSITION_ORDER_STATUS,
+                                       (status, order_id, sources[0], sources[-1]))
+            changed = cursor.rowcount == 1
+            if changed and status == "cancelled":
+                rows = query_all(cnx, statements.ORDER_SALE_LINES, (order_id,))
+                if rows and rows[0][0] is not None:
+                    lines = [row[1:] for row in rows if row[1] is not None]
+                    with cnx.cursor() as rollup:
+                        add_sales(rollup, [(rows[0][0], lines)], cancelled=True)
+            cnx.commit()
+        if changed:
+            cache_order_status(order_id, status)
+        return changed
+
+    except DB_ERRORS as err:
+        logger.error("Order %s status change to %s failed: %s", order_id, status, err)
+        return None
 
-        success = cursor.rowcount > 0
-        cursor.close()
-        cnx.close()
-        return success
 
-    except mysql.connector.Error as err:
-        logger.error(f"Cancel order error: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
-        return False
+def cancel_order(order_id: int):
+    """Cancel an order that is not yet delivered; its lines stay in orders for history"""
+    return transition_order_status(order_id, "cancelled")
+
 
+@metrics.instrumented
 def debug_order_tables(order_id):
     """Debug function to check what's in both tables"""
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
+        with get_db_connection() as cnx:
+            # Check orders table
+            orders_result = query_all(cnx, statements.DEBUG_ORDER_ROWS, (order_id,))
 
-        # Check orders table
-        cursor.execute("SELECT * FROM orders WHERE order_id = %s", (order_id,))
-        orders_result = cursor.fetchall()
+            # Check order_tracking table
+            tracking_result = query_all(cnx, statements.DEBUG_TRACKING_ROWS, (order_id,))
 
-        # Check order_tracking table
-        cursor.execute("SELECT * FROM order_tracking WHERE order_id = %s", (order_id,))
-        tracking_result = cursor.fetchall()
+            # Get all recent orders for debugging
+            recent_orders = query_all(cnx, statements.RECENT_ORDER_IDS)
 
-        # Get all recent orders for debugging
-        cursor.execute("SELECT DISTINCT order_id FROM orders ORDER BY order_id DESC LIMIT 10")
-        recent_orders = cursor.fetchall()
-
-        cursor.close()
-        cnx.close()
-
-        logger.info(f"Orders table for order_id {order_id}: {orders_result}")
-        logger.info(f"Order_tracking table for order_id {order_id}: {tracking_result}")
-        logger.info(f"Recent order IDs: {recent_orders}")
+        logger.debug("Orders table for order_id %s: %s", order_id, orders_result)
+        logger.debug("Order_tracking table for order_id %s: %s", order_id, tracking_result)
+        logger.debug("Recent order IDs: %s", recent_orders)
 
         return {
             "orders": orders_result,
@@ -216,140 +510,160 @@ def debug_order_tables(order_id):
             "recent_orders": recent_orders
         }
 
-    except mysql.connector.Error as err:
-        logger.error(f"Debug query failed: {err}")
-        if 'cnx' in locals(): cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Debug query failed: %s", err)
         return None
 
 
-def update_menu_item(food_name, price):
+def stream_rows(sql, params=(), batch_size=EXPORT_BATCH_SIZE):
+    """Yield result rows as dicts, ``batch_size`` at a time, from an unbuffered cursor.
+
+    The pooled connection is held until the stream is exhausted. A stream
+    abandoned part-way discards its connection instead of draining the rest
+    of the result set.
+    """
+    pool = get_pool()
+    pooled = pool.acquire()
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("UPDATE food_items SET price = %s WHERE name = %s", (price, food_name))
-        cnx.commit()
+        cursor = profiling.traced_connection(pooled.raw).cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
         cursor.close()
-        cnx.close()
+    except BaseException:
+        pool.release(pooled, discard=True)
+        raise
+    _release(pool, pooled)
+
+
+def _date_range(column, start, end):
+    """WHERE clauses and params for ``start <= column < end + 1 day``; either bound may be None"""
+    clauses, params = [], []
+    if start is not None:
+        clauses.append(f"{column} >= %s")
+        params.append(datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        clauses.append(f"{column} < %s")
+        params.append(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return clauses, params
+
+
+ORDER_EXPORT_COLUMNS = ("order_id", "status", "placed_at", "item_id", "name", "quantity", "total_price")
+RESERVATION_EXPORT_COLUMNS = ("reservation_id", "customer_name", "reservation_date", "time", "party_size")
+
+
+def stream_orders(start=None, end=None, status=None):
+    """Order lines with their tracking status, filtered by the day the order was placed and by status"""
+    return stream_rows(*order_export_query(start, end, status))
+
+
+def order_export_query(start=None, end=None, status=None):
+    """(sql, params) stream_orders runs"""
+    clauses, params = _date_range("t.placed_at", start, end)
+    if status is not None:
+        clauses.append("t.status = %s")
+        params.append(status)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"""
+        SELECT t.order_id, t.status, t.placed_at, o.item_id, f.name, o.quantity, o.total_price
+        FROM order_tracking t
+        JOIN orders o ON o.order_id = t.order_id
+        LEFT JOIN food_items f ON f.item_id = o.item_id
+        {where}
+        ORDER BY t.order_id, o.item_id
+    """, params
+
+
+def stream_reservations(start=None, end=None):
+    """Reservations whose date falls in the given range"""
+    return stream_rows(*reservation_export_query(start, end))
+
+
+def reservation_export_query(start=None, end=None):
+    """(sql, params) stream_reservations runs"""
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("reservation_date >= %s")
+        params.append(start)
+    if end is not None:
+        clauses.append("reservation_date <= %s")
+        params.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"""
+        SELECT reservation_id, customer_name, reservation_date, time, party_size
+        FROM reservations {where}
+        ORDER BY reservation_date, time, reservation_id
+    """, params
+
+
+@metrics.instrumented
+def update_menu_item(food_name, price):
+    try:
+        with get_db_connection() as cnx:
+            run_statement(cnx, statements.UPDATE_MENU_PRICE, (price, food_name))
+            cnx.commit()
+        menu_cache.invalidate()
         return True
-    except mysql.connector.Error as err:
-        logger.error(f"Error updating menu item: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Error updating menu item: %s", err)
         return False
 
 
+@metrics.instrumented
 def get_next_item_id():
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT IFNULL(MAX(item_id), 0) + 1 FROM food_items")
-        result = cursor.fetchone()[0]
-        cursor.close()
-        cnx.close()
+        with get_db_connection() as cnx:
+            result = query_one(cnx, statements.NEXT_ITEM_ID)[0]
         return result
-    except mysql.connector.Error as err:
-        logger.error(f"Error fetching next item ID: {err}")
-        if 'cnx' in locals(): cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Error fetching next item ID: %s", err)
         return None
 
 
+@metrics.instrumented
 def get_item_id(food_item):
-    try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT item_id FROM food_items WHERE LOWER(name) = LOWER(%s)", (food_item,))
-        result = cursor.fetchone()
-        cursor.close()
-        cnx.close()
-        if result:
-            logger.info(f"Found item_id for {food_item}: {result[0]}")
-            return result[0]
-        else:
-            logger.warning(f"No item_id found for {food_item}")
-            return None
-    except mysql.connector.Error as err:
-        logger.error(f"Error fetching item_id: {err}")
-        if 'cnx' in locals(): cnx.close()
+    item = menu_cache.lookup(food_item)
+    if item:
+        logger.info("Found item_id for %s: %s", food_item, item.item_id)
+        return item.item_id
+    else:
+        logger.warning("No item_id found for %s", food_item)
         return None
 
 
+@metrics.instrumented
 def register_user(username, email, password):
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-        if cursor.fetchone():
-            cursor.close()
-            cnx.close()
-            return -1  # Email exists
-        cursor.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", (username, email, password))
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        with get_db_connection() as cnx:
+            # ux_users_email rejects duplicates, so no SELECT beforehand
+            run_statement(cnx, statements.INSERT_USER, (username, email, password))
+            cnx.commit()
         return 1
-    except mysql.connector.Error as err:
-        logger.error(f"Registration error: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
+    except backend.integrity_error:
+        logger.info("Registration rejected, email already registered: %s", email)
         return -1
-
-
-def insert_reservation(customer_name, reservation_date, time):
-    try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("""
-            INSERT INTO reservations (customer_name, reservation_date, time)
-            VALUES (%s, %s, %s)
-        """, (customer_name, reservation_date, time))
-        cnx.commit()
-        last_id = cursor.lastrowid
-        cursor.close()
-        cnx.close()
-        return last_id
-    except mysql.connector.Error as err:
-        logger.error(f"Insert reservation error: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Registration error: %s", err)
         return -1
 
 
+@metrics.instrumented
 def get_reservation(reservation_id):
     try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor(dictionary=True)
+        result = None
         if reservation_id:
-            cursor.execute("SELECT * FROM reservations WHERE reservation_id = %s", (reservation_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        cnx.close()
+            with get_db_connection() as cnx:
+                result = query_one(cnx, statements.GET_RESERVATION, (reservation_id,))
+        if result:
+            reservation_fallback.set(result["reservation_id"], result)
         return result
-    except mysql.connector.Error as err:
-        logger.error(f"Get reservation error: {err}")
-        if 'cnx' in locals(): cnx.close()
+    except DB_ERRORS as err:
+        logger.error("Get reservation error: %s", err)
         return None
 
 
-def cancel_reservation(reservation_id: int):
-    try:
-        cnx = get_db_connection()
-        cursor = cnx.cursor()
-        cursor.execute("DELETE FROM reservations WHERE reservation_id = %s", (reservation_id,))
-        cnx.commit()
-        success = cursor.rowcount > 0
-        cursor.close()
-        cnx.close()
-        return success
-    except mysql.connector.Error as err:
-        logger.error(f"Cancel reservation error: {err}")
-        if 'cnx' in locals():
-            cnx.rollback()
-            cnx.close()
-        return False
-
-
 if __name__ == "__main__":
     print(f"Next available order ID: {get_next_order_id()}")
\ No newline at end of file
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+
+class _PooledConnection:
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Bounded pool of database connections.
+
+    ``connect`` opens a new raw connection and ``ping`` returns True when a raw
+    connection is still usable. Connections older than ``recycle`` seconds are
+    closed and replaced on checkout, and connections that sat idle for longer
+    than ``health_check_after`` seconds are pinged before being handed out.
+    """
+
+    def __init__(self, connect, ping, size=10, checkout_timeout=5.0, recycle=1800.0,
+                 health_check_after=30.0, on_checkout=None):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self._connect = connect
+        self._ping = ping
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.recycle = recycle
+        self.health_check_after = health_check_after
+        # Called with the seconds each checkout spent waiting for a connection
+        self.on_checkout = on_checkout
+
+        self._idle = deque()
+        self._opened = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Check out a connection, waiting up to ``timeout`` seconds for a free slot"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    # Reserve the slot before connecting outside the lock
+                    self._opened += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {timeout:.1f}s "
+                                      f"(pool size {self.size})")
+                self._cond.wait(remaining)
+
+        if pooled is not None:
+            pooled = self._validate(pooled)
+        if pooled is None:
+            pooled = self._open()
+        if self.on_checkout is not None:
+            self.on_checkout(time.monotonic() - started)
+        return pooled
+
+    def release(self, pooled, discard=False):
+        """Return a checked-out connection, or close it when ``discard`` is set"""
+        if discard:
+            self._close(pooled)
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def prefill(self, count):
+        """Open up to ``count`` idle connections ahead of traffic"""
+        opened = []
+        try:
+            for _ in range(min(count, self.size)):
+                with self._cond:
+                    if self._opened >= self.size or self._opened >= count:
+                        break
+                    self._opened += 1
+                opened.append(self._open())
+        finally:
+            for pooled in opened:
+                self.release(pooled)
+        return len(opened)
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self.size, "opened": self._opened, "idle": len(self._idle),
+                    "in_use": self._opened - len(self._idle)}
+
+    def _open(self):
+        try:
+            logger.info("Opening new pooled database connection")
+            return _PooledConnection(self._connect())
+        except BaseException:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def _validate(self, pooled):
+        """Return ``pooled`` if it is still usable, otherwise close it and return None"""
+        now = time.monotonic()
+        if now - pooled.created_at > self.recycle:
+            logger.debug("Recycling stale database connection")
+        elif now - pooled.last_used <= self.health_check_after:
+            return pooled
+        else:
+            try:
+                if self._ping(pooled.raw):
+                    return pooled
+            except Exception as err:
+                logger.warning("Pooled connection failed health check: %s", err)
+        self._close(pooled)
+        return None
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.raw.close()
+        except Exception:
+            pass
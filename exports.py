@@ -0,0 +1,100 @@
+"""CSV and NDJSON streaming for the admin export endpoints.
+
+Rows arrive from db_helper's unbuffered streams in batches and are encoded
+one batch per chunk, so memory use depends on the batch size, not on the
+number of rows exported.
+
+Every running export holds a pooled connection until its download ends,
+so at most EXPORT_MAX_CONCURRENT run at once per worker; further requests
+wait up to EXPORT_QUEUE_TIMEOUT seconds for a slot and are then refused.
+"""
+import asyncio
+import csv
+import datetime
+import io
+import logging
+import os
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from admission import AdmissionController
+
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+EXPORT_QUEUE_TIMEOUT = float(os.getenv("EXPORT_QUEUE_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+admission = AdmissionController(EXPORT_MAX_CONCURRENT, queue_timeout=EXPORT_QUEUE_TIMEOUT,
+                                max_waiting=EXPORT_MAX_CONCURRENT)
+metrics.Gauge("export_in_flight", "Exports holding a database connection", lambda: admission.in_flight)
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _default(value):
+    # Decimals stay exact; MySQL returns TIME columns as timedelta
+    if isinstance(value, (Decimal, datetime.timedelta)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def csv_chunks(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows([row[column] for column in columns] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(batches, columns):
+    for rows in batches:
+        yield b"".join(orjson.dumps({column: row[column] for column in columns}, default=_default) + b"\n"
+                       for row in rows)
+
+
+def _logged(chunks, name):
+    try:
+        yield from chunks
+    except Exception as err:
+        # Headers are already sent; raising aborts the response so clients see a truncated transfer
+        logger.error("Export %s failed mid-stream: %s", name, err)
+        raise
+
+
+def _holding_slot(batches, loop):
+    try:
+        yield from batches
+    finally:
+        # Runs when the stream ends, fails or is garbage collected unread, like its connection release
+        admission.release_threadsafe(loop)
+
+
+async def export_response(batches, columns, fmt, name):
+    """Stream ``batches`` of row dicts as a ``fmt`` attachment.
+
+    The query runs before the response starts, so a database failure can
+    still be raised to the caller instead of truncating an attachment.
+    Raises Overloaded when no export slot frees up in time.
+    """
+    loop = asyncio.get_running_loop()
+    await admission.acquire(f"export {name}")
+    batches = _holding_slot(batches, loop)
+    first = await run_in_threadpool(next, batches, None)
+
+    def all_batches():
+        if first is not None:
+            yield first
+            yield from batches
+
+    encode = csv_chunks if fmt == "csv" else ndjson_chunks
+    return StreamingResponse(_logged(encode(all_batches(), columns), name), media_type=MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
@@ -0,0 +1,56 @@
+import threading
+from typing import Callable
+
+
+class BlockIdAllocator:
+    """Hands out unique IDs from blocks reserved in a shared counter.
+
+    ``reserve_block(count)`` must atomically advance the shared counter by
+    ``count`` and return the first ID of the reserved range. Each process
+    serves IDs from its current block in memory and only goes back to the
+    database once the block is used up, so concurrent workers never collide.
+    IDs left in a block when the process exits are skipped.
+    """
+
+    def __init__(self, reserve_block: Callable[[int], int], block_size: int = 20):
+        if block_size < 1:
+            raise ValueError("block size must be at least 1")
+        self._reserve_block = reserve_block
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            self._refill()
+            value = self._next
+            self._next += 1
+            return value
+
+    def next_id_nowait(self):
+        """Next ID from the block in hand, or None when a block has to be (or is being) reserved"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._next >= self._end:
+                return None
+            value = self._next
+            self._next += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def prefetch(self):
+        """Reserve a block now if none is in hand, so the next ID is served from memory"""
+        with self._lock:
+            self._refill()
+
+    def _refill(self):
+        if self._next >= self._end:
+            start = self._reserve_block(self.block_size)
+            self._next, self._end = start, start + self.block_size
+
+    def remaining(self) -> int:
+        with self._lock:
+            return self._end - self._next
@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+from ttl_cache import TTLCache
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "300"))
+IDEMPOTENCY_MAX_SIZE = int(os.getenv("IDEMPOTENCY_MAX_SIZE", "10000"))
+
+
+class IdempotencyCache:
+    """Runs a coroutine once per key and hands its result to every duplicate.
+
+    A duplicate that arrives while the first call is still running waits for
+    that call instead of starting its own. Completed results are kept for
+    ``ttl`` seconds in a bounded LRU. When the first call raises, nothing is
+    stored and waiting duplicates run the work themselves.
+    """
+
+    def __init__(self, max_size=IDEMPOTENCY_MAX_SIZE, ttl=IDEMPOTENCY_TTL):
+        self._results = TTLCache(max_size=max_size, ttl=ttl)
+        self._inflight = {}
+        # Duplicates answered from a stored or in-flight result
+        self.hits = 0
+
+    async def run(self, key, produce):
+        """Return ``await produce()``, or the result of the earlier call made with ``key``"""
+        while True:
+            result = self._results.get(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            # shield: a duplicate that gets cancelled must not cancel the original
+            result = await asyncio.shield(pending)
+            if result is not None:
+                self.hits += 1
+                return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        result = None
+        try:
+            result = await produce()
+            self._results.set(key, result)
+            return result
+        finally:
+            del self._inflight[key]
+            future.set_result(result)
+
+    @property
+    def evictions(self):
+        return self._results.evictions
+
+    def __len__(self):
+        return len(self._results)
@@ -1,16 +1,99 @@
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+import async_db
+from admission import Overloaded
 import db_helper
+import exports
 import generic_helper
+from idempotency import IdempotencyCache
+import metrics
+import passwords
+import profiling
+import reservation_engine
+import schema
+from order_queue import OrderQueue, QueuedOrder
+import session_store
+import structured_logging
+from webhook import FastJSONResponse, WebhookRequest
 import logging
 from pydantic import BaseModel
-import hashlib
-from datetime import datetime
+import os
+import time
+import uuid
+from datetime import date, datetime
 
-app = FastAPI()
-inprogress_orders = {}
+structured_logging.configure_logging()
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(level=logging.DEBUG)
+
+SCHEMA_AUTO_MIGRATE = os.getenv("SCHEMA_AUTO_MIGRATE", "1") == "1"
+# Startup waits at most this long for warmup; /ready retries it until it succeeds
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+# How long a status change waits for the order queue to commit an order it still holds
+ORDER_FLUSH_TIMEOUT = float(os.getenv("ORDER_FLUSH_TIMEOUT", "5"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SCHEMA_AUTO_MIGRATE:
+        try:
+            await async_db.run(schema.bootstrap)
+        except (schema.SchemaError, *db_helper.DB_ERRORS) as e:
+            logger.error("Schema bootstrap failed: %s", e)
+    # Load the menu before the first order so pricing never waits on MySQL
+    await async_db.refresh_menu()
+    order_queue.start()
+    await warm_up()
+    yield
+    await asyncio.to_thread(order_queue.stop)
+    async_db.shutdown()
+    passwords.shutdown()
+    profiling.shutdown()
+    db_helper.get_pool().close_all()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+inprogress_orders = session_store.create_session_store()
+
+metrics.Gauge("inprogress_orders", "Carts currently held in the session store", inprogress_orders.size)
+metrics.Gauge("session_store_evictions_total", "Carts evicted from the session store",
+              lambda: inprogress_orders.evictions, kind="counter")
+
+webhook_replies = IdempotencyCache()
+metrics.Gauge("webhook_duplicate_requests_total", "Retried webhook calls answered with the original reply",
+              lambda: webhook_replies.hits, kind="counter")
+metrics.Gauge("log_records_dropped_total", "Log records dropped because the log queue was full",
+              lambda: structured_logging.dropped, kind="counter")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Every log line written while serving the request carries its id
+    rid = request.headers.get("x-request-id") or uuid.uuid4().hex
+    structured_logging.request_id.set(rid)
+    db_calls = metrics.start_request()
+    start = time.perf_counter()
+    try:
+        with profiling.maybe_trace(request.url.path, request.headers.get(profiling.PROFILE_HEADER)) as query_trace:
+            response = await call_next(request)
+            if query_trace is not None:
+                route = request.scope.get("route")
+                query_trace.label = route.path if route else "unmatched"
+                response.headers["X-Query-Count"] = str(len(query_trace.statements))
+        response.headers["X-Request-ID"] = rid
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        intent = getattr(request.state, "intent", "")
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, route_path, intent)
+        metrics.REQUEST_DB_CALLS.observe(db_calls[0], route_path)
 
 
 class User(BaseModel):
@@ -27,95 +110,123 @@ class Reservation(BaseModel):
     party_size: int
 
 
-@app.post("/")
-async def handle_request(request: Request, background_tasks: BackgroundTasks):
-    try:
-        payload = await request.json()
-        logging.debug(f"Received request: {payload}")
-
-        intent = payload['queryResult']['intent']['displayName']
-        parameters = payload['queryResult']['parameters']
-        output_contexts = payload['queryResult'].get('outputContexts', [])
-
-        if not output_contexts:
-            return JSONResponse(content={"fulfillmentText": "Session not found. Please start a new order."})
-
-        session_id = generic_helper.extract_session_id(output_contexts[0]["name"])
-        print(session_id)
-
-        intent_handler_dict = {
-            'order.add - context: ongoing-order': add_to_order,
-            'order.remove - context: ongoing-order': remove_from_order,
-            'order.cancel - context: cancel-order': cancel_order,
-            'track.order - context: ongoing-tracking': track_order,
-            'book_reservation': handle_reservation_booking,
-            'check_reservation': handle_reservation_check,
-            'cancel_reservation': handle_reservation_cancel
-        }
+# Sent when admission control sheds a request instead of letting Dialogflow time out
+BUSY_TEXT = "Sorry, we're very busy right now. Please try again in a moment."
 
-        if intent == 'order.complete - context: ongoing-order':
-            return await complete_order(parameters, session_id, background_tasks)
 
-        # if intent == 'order.cancel - context: cancel-order':
-        #     return JSONResponse(content={"fulfillmentText": "I didn't understand that request."})
-
-        if intent in intent_handler_dict:
-            return intent_handler_dict[intent](parameters, session_id)
-
-        logging.info(f"Intent not handled: {intent}, Parameters: {parameters}, Contexts: {output_contexts}")
-        return JSONResponse(content={"fulfillmentText": "I 't understand that request."})
-
-    except KeyError as e:
-        logging.error(f"KeyError: {e}")
-        return JSONResponse(content={"fulfillmentText": f"KeyError: {e}"})
+@app.post("/")
+async def handle_request(request: Request):
+    try:
+        payload = WebhookRequest.model_validate_json(await request.body())
+        intent = payload.intent
+        parameters = payload.parameters
+        request.state.intent = intent
+        structured_logging.intent.set(intent)
+
+        session_id = payload.session_id
+        structured_logging.session_id.set(session_id)
+        if session_id is None:
+            return FastJSONResponse(content={"fulfillmentText": "Session not found. Please start a new order."})
+
+        handler = INTENT_HANDLERS.get(intent)
+        if handler is not None:
+            if payload.responseId is None:
+                return await handler(parameters, session_id)
+            # A retried responseId gets the first reply instead of placing the order twice
+            return await webhook_replies.run((payload.responseId, session_id),
+                                             lambda: handler(parameters, session_id))
+
+        logger.info("Intent not handled: %s", intent)
+        logger.debug("Unhandled intent parameters: %s", parameters)
+        request.state.intent = "unhandled"
+        return FastJSONResponse(content={"fulfillmentText": "I 't understand that request."})
+
+    except Overloaded as e:
+        logger.warning("Shed %s: %s", intent, e)
+        return FastJSONResponse(content={"fulfillmentText": BUSY_TEXT})
+
+    except ValidationError as e:
+        logger.error("Malformed webhook request: %s", e.errors(include_url=False, include_input=False))
+        return FastJSONResponse(content={"fulfillmentText": "Sorry, I couldn't read that request."})
 
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return JSONResponse(content={"fulfillmentText": "An unexpected error occurred. Please try again later."})
+        logger.error("Unexpected error: %s", e)
+        return FastJSONResponse(content={"fulfillmentText": "An unexpected error occurred. Please try again later."})
+
 
+async def resolve_food_items(food_items):
+    """Menu name for each typed food name, or None for names that are not on the menu.
 
-def add_to_order(parameters: dict, session_id: str):
+    Runs in the event loop against the menu snapshot. Until a menu has been
+    loaded at all, names are passed through unchanged and priced at checkout.
+    """
+    menu = db_helper.menu_cache
+    if menu.stale:
+        try:
+            await async_db.refresh_menu()
+        except Overloaded:
+            pass
+    if not len(menu):
+        return list(food_items)
+    names = []
+    for name in food_items:
+        item = menu.lookup(name, refresh=False)
+        names.append(item.name if item else None)
+    return names
+
+
+async def add_to_order(parameters: dict, session_id: str):
     food_items = parameters.get("food-item", [])
     quantities = parameters.get("number", [])
 
     if len(food_items) != len(quantities):
-        return JSONResponse(content={"fulfillmentText": "Please specify food items and quantities clearly."})
+        return FastJSONResponse(content={"fulfillmentText": "Please specify food items and quantities clearly."})
 
-    new_food_dict = dict(zip(food_items, quantities))
+    menu_names = await resolve_food_items(food_items)
+    new_food_dict = {name: quantity for name, quantity in zip(menu_names, quantities) if name is not None}
+    unknown = [typed for typed, name in zip(food_items, menu_names) if name is None]
+    unknown_text = f"We couldn't find {', '.join(unknown)} on our menu. " if unknown else ""
 
-    if session_id in inprogress_orders:
-        inprogress_orders[session_id].update(new_food_dict)
-    else:
-        inprogress_orders[session_id] = new_food_dict
+    current_order = await inprogress_orders.aget(session_id) or {}
+    if not new_food_dict and not current_order:
+        return FastJSONResponse(content={"fulfillmentText": f"{unknown_text}What would you like to order?"})
+    current_order.update(new_food_dict)
+    await inprogress_orders.aset(session_id, current_order)
 
-    order_str = generic_helper.get_str_from_food_dict(inprogress_orders[session_id])
-    return JSONResponse(content={"fulfillmentText": f"So far, you have: {order_str}. Do you need anything else?"})
+    order_str = generic_helper.get_str_from_food_dict(current_order)
+    return FastJSONResponse(content={
+        "fulfillmentText": f"{unknown_text}So far, you have: {order_str}. Do you need anything else?"})
 
 
-def cancel_order(parameters: dict, session_id: str):
-    logging.info("Processing order cancellation")
+async def cancel_order(parameters: dict, session_id: str):
+    logger.info("Processing order cancellation")
     try:
         order_id = parameters.get("number")
         if not order_id:
-            return JSONResponse(content={"fulfillmentText": "Please provide your order ID to cancel the order."})
+            return FastJSONResponse(content={"fulfillmentText": "Please provide your order ID to cancel the order."})
 
         try:
             order_id = int(order_id)
         except ValueError:
-            return JSONResponse(content={"fulfillmentText": "Invalid order ID. Please provide a valid number."})
+            return FastJSONResponse(content={"fulfillmentText": "Invalid order ID. Please provide a valid number."})
 
         # Use the database function to cancel the order
-        success = db_helper.cancel_order(order_id)
+        success = await transition_order(order_id, "cancelled")
 
         if success:
-            return JSONResponse(content={"fulfillmentText": f"✅ Order #{order_id} has been successfully canceled."})
+            return FastJSONResponse(content={"fulfillmentText": f"✅ Order #{order_id} has been successfully canceled."})
+        elif success is None:
+            return FastJSONResponse(content={
+                "fulfillmentText": f"We couldn't cancel order #{order_id} right now. Please try again in a moment."})
         else:
-            return JSONResponse(content={
+            return FastJSONResponse(content={
                 "fulfillmentText": f"Unable to cancel order #{order_id}. Order may not exist or has already been delivered/cancelled."})
 
+    except Overloaded:
+        raise
     except Exception as e:
-        logging.error(f"Error in cancel_order: {e}")
-        return JSONResponse(content={"fulfillmentText": "An error occurred while trying to cancel your order."})
+        logger.error("Error in cancel_order: %s", e)
+        return FastJSONResponse(content={"fulfillmentText": "An error occurred while trying to cancel your order."})
 # def cancel_order(parameters: dict, session_id: str ):
 #     logging.info("hello cancel")
 #     try:
@@ -136,20 +247,21 @@ def cancel_order(parameters: dict, session_id: str):
 #         return JSONResponse(content={"fulfillmentText": "An error occurred while trying to cancel your order (mocked)."})
 
 
-def remove_from_order(parameters: dict, session_id: str):
-    if session_id not in inprogress_orders:
-        return JSONResponse(
+async def remove_from_order(parameters: dict, session_id: str):
+    current_order = await inprogress_orders.aget(session_id)
+    if current_order is None:
+        return FastJSONResponse(
             content={"fulfillmentText": "I'm having trouble finding your order. Please place a new order."})
 
     food_items = parameters.get("food-item", [])
-    current_order = inprogress_orders[session_id]
+    menu_names = await resolve_food_items(food_items)
 
     removed_items = []
     no_such_items = []
 
-    for item in food_items:
-        if item not in current_order:
-            no_such_items.append(item)
+    for typed, item in zip(food_items, menu_names):
+        if item is None or item not in current_order:
+            no_such_items.append(typed)
         else:
             removed_items.append(item)
             del current_order[item]
@@ -161,202 +273,418 @@ def remove_from_order(parameters: dict, session_id: str):
         fulfillment_text += f" Your current order does not contain {', '.join(no_such_items)}."
     if not current_order:
         fulfillment_text += " Your order is now empty!"
-        del inprogress_orders[session_id]
+        await inprogress_orders.adelete(session_id)
     else:
+        await inprogress_orders.aset(session_id, current_order)
         order_str = generic_helper.get_str_from_food_dict(current_order)
         fulfillment_text += f" Here is what remains in your order: {order_str}."
 
-    return JSONResponse(content={"fulfillmentText": fulfillment_text})
+    return FastJSONResponse(content={"fulfillmentText": fulfillment_text})
 
 
-async def complete_order(parameters: dict, session_id: str, background_tasks: BackgroundTasks):
-    if session_id not in inprogress_orders:
-        return JSONResponse(content={
+async def complete_order(parameters: dict, session_id: str):
+    order = await inprogress_orders.aget(session_id)
+    if order is None:
+        return FastJSONResponse(content={
             "fulfillmentText": "I'm having trouble finding your order. Please start a new one."
         })
 
-    order = inprogress_orders[session_id]
-
     # Get next order ID
-    order_id = db_helper.get_next_order_id()
+    order_id = await async_db.get_next_order_id()
     if order_id is None:
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "fulfillmentText": "Oops! Couldn't generate order ID. Please try again later."
         })
 
-    # Calculate total price for this order
-    total_price = db_helper.calculate_order_total(order)
-    if total_price == 0:
-        return JSONResponse(content={
+    # Price the cart once; the same lines are persisted so the stored total matches the quote
+    priced_order = await async_db.price_order(order)
+    if not priced_order.lines:
+        return FastJSONResponse(content={
             "fulfillmentText": "Error calculating order total. Please check your items and try again."
         })
 
-    # Immediately return to Dialogflow
-    response = JSONResponse(content={
-        "fulfillmentText": f"Got it! Your order is being processed. Order ID: #{order_id}. Total: ${total_price:.2f}"
-    })
-
-    # Offload to background task
-    background_tasks.add_task(process_order_background, order, order_id, session_id)
-    return response
+    fulfillment_text = f"Got it! Your order is being processed. Order ID: #{order_id}. Total: ${priced_order.total:.2f}"
+    if priced_order.missing:
+        fulfillment_text += f" We couldn't find {', '.join(priced_order.missing)} on our menu, so it was left out."
 
-
-async def process_order_background(order: dict, order_id: int, session_id: str):
+    # Journal the order durably before confirming it; the queue worker writes it to MySQL
     try:
-
-        # Save order to database
-        save_result = save_to_db(order, order_id)
-
-        # Insert order tracking first
-        db_helper.insert_order_tracking(order_id, "in progress")
-
-
-
-        if "error" in save_result:
-            logging.error(f"Failed to save order {order_id}: {save_result['error']}")
-        else:
-            logging.info(f"Order #{order_id} saved successfully")
-
+        await asyncio.to_thread(order_queue.enqueue, order_id, priced_order)
     except Exception as e:
-        logging.error(f"Background task failed for order {order_id}: {str(e)}")
-    finally:
-        # Clean up session
-        if session_id in inprogress_orders:
-            del inprogress_orders[session_id]
+        logger.error("Failed to queue order %s: %s", order_id, e)
+        return FastJSONResponse(content={
+            "fulfillmentText": "Sorry, we couldn't place your order right now. Please try again."
+        })
 
+    db_helper.cache_order_status(order_id, "in progress")
+    await inprogress_orders.adelete(session_id)
+    return FastJSONResponse(content={"fulfillmentText": fulfillment_text})
 
-def save_to_db(order: dict, order_id: int):
-    cnx = None
-    cursor = None
-    try:
-        cnx = db_helper.get_db_connection()
-        cursor = cnx.cursor()
 
-        for food_item, quantity in order.items():
-            cursor.execute("SELECT item_id, price FROM food_items WHERE LOWER(name) = LOWER(%s)", (food_item,))
-            result = cursor.fetchone()
+async def transition_order(order_id: int, status: str):
+    """async_db.transition_order_status, first letting the order queue commit the order if it still holds it.
 
-            if not result:
-                logging.error(f"Item not found: {food_item}")
-                return {"error": f"Item {food_item} not found"}
+    A customer gets the order ID before the order reaches the database, so
+    a refused change is retried once the order has left the journal, which
+    it may have done since the first attempt. Returns None when the order is
+    still journaled after ORDER_FLUSH_TIMEOUT.
+    """
+    changed = await async_db.transition_order_status(order_id, status)
+    if changed is False:
+        if not await asyncio.to_thread(order_queue.flush, order_id, ORDER_FLUSH_TIMEOUT):
+            logger.warning("Order %s is still queued; cannot move it to %s yet", order_id, status)
+            return None
+        changed = await async_db.transition_order_status(order_id, status)
+    return changed
 
-            item_id, price = result
-            total_price = price * int(quantity)
-            cursor.execute("INSERT INTO orders (order_id, item_id, quantity, total_price) VALUES (%s, %s, %s, %s)",
-                           (order_id, item_id, quantity, total_price))
 
-        cnx.commit()
+@metrics.instrumented
+def save_to_db(batch: List[QueuedOrder]):
+    """Group-commit a batch of queued orders and their tracking rows in one transaction"""
+    try:
+        with profiling.maybe_trace("save_to_db"), db_helper.get_db_connection() as cnx:
+            with cnx.cursor() as cursor:
+                # Orders replayed after a crash may already have been committed
+                order_ids = [order.order_id for order in batch]
+                committed = db_helper.get_tracked_order_ids(cursor, order_ids)
+                pending = [order for order in batch if order.order_id not in committed]
+
+                placed_at = [datetime.fromtimestamp(order.placed_at) for order in pending]
+                db_helper.insert_order_lines(cursor, [(order.order_id, order.priced_order) for order in pending])
+                db_helper.insert_order_tracking_rows(
+                    cursor, [(order.order_id, placed) for order, placed in zip(pending, placed_at)], "in progress")
+                # Rollups move in the same transaction, so they never count an order that did not commit
+                db_helper.add_sales(cursor, [
+                    (placed, [(line.item_id, line.quantity, line.line_total) for line in order.priced_order.lines])
+                    for order, placed in zip(pending, placed_at)])
+            cnx.commit()
+        for order in pending:
+            db_helper.cache_order_status(order.order_id, "in progress")
+        logger.info("Saved orders %s", order_ids)
         return {"success": True}
 
     except Exception as e:
-        logging.error(f"Database save failed: {str(e)}")
-        if cnx:
-            cnx.rollback()
+        logger.error("Database save failed: %s", e)
         return {"error": str(e)}
-    finally:
-        if cursor: cursor.close()
-        if cnx: cnx.close()
 
 
-def track_order(parameters: dict, session_id: str):
+order_queue = OrderQueue(save_to_db)
+
+metrics.Gauge("order_queue_depth", "Orders journaled but not yet committed", order_queue.depth)
+metrics.Gauge("order_queue_last_batch_size", "Orders in the most recent group commit",
+              lambda: order_queue.last_batch_size)
+metrics.Gauge("order_queue_committed_orders_total", "Orders committed by the queue worker",
+              lambda: order_queue.committed_orders, kind="counter")
+metrics.Gauge("order_queue_commit_batches_total", "Group commits made by the queue worker",
+              lambda: order_queue.committed_batches, kind="counter")
+metrics.Gauge("order_queue_failed_batches_total", "Group commits that failed",
+              lambda: order_queue.failed_batches, kind="counter")
+
+
+async def track_order(parameters: dict, session_id: str):
     # Try different parameter names that Dialogflow might use
     order_id = parameters.get('order_id') or parameters.get('number') or parameters.get('item_id')
 
     if not order_id:
-        return JSONResponse(content={"fulfillmentText": "Please provide your order ID to track your order."})
+        return FastJSONResponse(content={"fulfillmentText": "Please provide your order ID to track your order."})
 
     try:
         order_id = int(order_id)
     except (ValueError, TypeError):
-        return JSONResponse(content={"fulfillmentText": "Invalid order ID provided. Please provide a valid number."})
-
-    # Debug: Check what's in the database
-    debug_info = db_helper.debug_order_tables(order_id)
-    logging.info(f"Debug info for order {order_id}: {debug_info}")
+        return FastJSONResponse(content={"fulfillmentText": "Invalid order ID provided. Please provide a valid number."})
 
-    order_status = db_helper.get_order_status(order_id)
+    # Served from the status cache without a thread hop when possible
+    order_status = db_helper.order_status_cache.get(order_id) or await async_db.get_order_status(order_id)
     if order_status:
-        return JSONResponse(
+        return FastJSONResponse(
             content={"fulfillmentText": f"The order status for order ID #{order_id} is: {order_status}."})
 
-    return JSONResponse(content={
+    return FastJSONResponse(content={
         "fulfillmentText": f"No order found with order ID #{order_id}. Please check your order ID and try again."})
 
 
-def handle_reservation_booking(parameters: dict, session_id: str):
+async def handle_reservation_booking(parameters: dict, session_id: str):
     try:
         customer_name = parameters.get("given-name")
         time_str = parameters.get("time")
         time = datetime.fromisoformat(time_str.replace("Z", "")).time()
         date = parameters.get("date")
         reservation_date = datetime.fromisoformat(date.replace("Z", "")).date()
+        party_size = int(parameters.get("number") or reservation_engine.DEFAULT_PARTY_SIZE)
 
         if not all([customer_name, reservation_date, time]):
-            print(customer_name, reservation_date, time)
-            return JSONResponse(content={
+            return FastJSONResponse(content={
                 "fulfillmentText": "Missing reservation details. Please provide customer_name, email, phone, reservation_datetime, party_size ."})
-
-        reservation_id = db_helper.insert_reservation(customer_name, reservation_date, time)
-
-        if reservation_id == -1:
-            return JSONResponse(content={"fulfillmentText": "Failed to book reservation. Please try again."})
-        return JSONResponse(
-            content={"fulfillmentText": f"Reservation confirmed! Your reservation ID is {reservation_id}."})
+        if party_size < 1:
+            return FastJSONResponse(content={"fulfillmentText": "Please tell me how many people the table is for."})
+
+        booking = await async_db.book_reservation(customer_name, reservation_date, time, party_size)
+
+        if booking is None:
+            return FastJSONResponse(content={"fulfillmentText": "Failed to book reservation. Please try again."})
+        if booking.reservation_id is None:
+            wanted = f"{party_size} at {time:%H:%M} on {reservation_date:%A, %B %d}"
+            if not booking.alternatives:
+                return FastJSONResponse(content={
+                    "fulfillmentText": f"Sorry, we have no table for {wanted}. Please try another day."})
+            options = " or ".join(f"{option:%H:%M}" for option in booking.alternatives)
+            return FastJSONResponse(content={
+                "fulfillmentText": f"Sorry, we're fully booked for {wanted}. We can seat you at {options}. "
+                                   f"Would one of those work?"})
+        return FastJSONResponse(content={
+            "fulfillmentText": f"Reservation confirmed for {party_size} at {time:%H:%M} on {reservation_date}! "
+                               f"Your reservation ID is {booking.reservation_id}."})
+    except Overloaded:
+        raise
     except Exception as e:
-        logging.error(f"Error booking reservation: {e}")
-        return JSONResponse(content={"fulfillmentText": "An error occurred while booking the reservation."})
+        logger.error("Error booking reservation: %s", e)
+        return FastJSONResponse(content={"fulfillmentText": "An error occurred while booking the reservation."})
 
 
-def handle_reservation_check(parameters: dict, session_id: str):
+async def handle_reservation_check(parameters: dict, session_id: str):
     try:
         ID = parameters.get("id")
         if not ID:
-            return JSONResponse(content={"fulfillmentText": "Please provide your id to check reservation."})
+            return FastJSONResponse(content={"fulfillmentText": "Please provide your id to check reservation."})
 
-        reservation = db_helper.get_reservation(ID)
+        reservation = await async_db.get_reservation(ID)
         if not reservation:
-            return JSONResponse(content={"fulfillmentText": "No reservation found for the provided id."})
+            return FastJSONResponse(content={"fulfillmentText": "No reservation found for the provided id."})
 
         res_date = reservation['reservation_date']
         time = reservation['time']
         customer_name = reservation['customer_name']
+        party_size = reservation.get('party_size', reservation_engine.DEFAULT_PARTY_SIZE)
 
-        return JSONResponse(content={
-            "fulfillmentText": f"Your reservation is on {res_date} at {time}, under the name {customer_name}."
+        return FastJSONResponse(content={
+            "fulfillmentText": f"Your reservation for {party_size} is on {res_date} at {time}, "
+                               f"under the name {customer_name}."
         })
+    except Overloaded:
+        raise
     except Exception as e:
-        logging.error(f"Error checking reservation: {e}")
-        return JSONResponse(content={"fulfillmentText": "An error occurred while checking your reservation."})
+        logger.error("Error checking reservation: %s", e)
+        return FastJSONResponse(content={"fulfillmentText": "An error occurred while checking your reservation."})
 
 
-def handle_reservation_cancel(parameters: dict, session_id: str):
+async def handle_reservation_cancel(parameters: dict, session_id: str):
     try:
         reservation_id = parameters.get("id")
         if not reservation_id:
-            return JSONResponse(content={"fulfillmentText": "Please provide your reservation ID to cancel it."})
+            return FastJSONResponse(content={"fulfillmentText": "Please provide your reservation ID to cancel it."})
 
-        success = db_helper.cancel_reservation(int(reservation_id))
+        success = await async_db.cancel_reservation(int(reservation_id))
         if success:
-            return JSONResponse(content={"fulfillmentText": "Your reservation has been canceled successfully."})
-        return JSONResponse(content={"fulfillmentText": "No reservation found with the provided ID."})
+            return FastJSONResponse(content={"fulfillmentText": "Your reservation has been canceled successfully."})
+        return FastJSONResponse(content={"fulfillmentText": "No reservation found with the provided ID."})
+    except Overloaded:
+        raise
     except Exception as e:
-        logging.error(f"Error canceling reservation: {e}")
-        return JSONResponse(content={"fulfillmentText": "An error occurred while canceling your reservation."})
+        logger.error("Error canceling reservation: %s", e)
+        return FastJSONResponse(content={"fulfillmentText": "An error occurred while canceling your reservation."})
+
+
+# Dialogflow intent display name -> handler(parameters, session_id)
+INTENT_HANDLERS = {
+    'order.add - context: ongoing-order': add_to_order,
+    'order.remove - context: ongoing-order': remove_from_order,
+    'order.complete - context: ongoing-order': complete_order,
+    'order.cancel - context: cancel-order': cancel_order,
+    'track.order - context: ongoing-tracking': track_order,
+    'book_reservation': handle_reservation_booking,
+    'check_reservation': handle_reservation_check,
+    'cancel_reservation': handle_reservation_cancel
+}
 
 
 @app.post("/register")
 async def register_user(user: User):
     try:
-        hashed_password = hashlib.sha256(user.password.encode()).hexdigest()
-        result = db_helper.register_user(user.username, user.email, hashed_password)
+        hashed_password = await passwords.hash_password(user.password)
+        result = await async_db.register_user(user.username, user.email, hashed_password)
         if result == 1:
             return {"message": "User registered successfully"}
         return {"error": "Email already exists or failed to register"}
+    except Overloaded:
+        return {"error": "We're getting a lot of signups right now. Please try again in a moment."}
     except Exception as e:
-        logging.error(f"Registration error: {str(e)}")
+        logger.error("Registration error: %s", e)
         return {"error": "Something went wrong during registration"}
 
 
+def require_admin(x_admin_token: str = Header(None)):
+    # Admin endpoints only exist when ADMIN_TOKEN is configured
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+
+
+@app.get("/admin/orders/{order_id}/debug", dependencies=[Depends(require_admin)])
+async def debug_order(order_id: int):
+    debug_info = await async_db.debug_order_tables(order_id)
+    if debug_info is None:
+        return {"error": "Debug query failed"}
+    return debug_info
+
+
+class StatusChange(BaseModel):
+    status: str
+
+
+@app.post("/admin/orders/{order_id}/status", dependencies=[Depends(require_admin)])
+async def change_order_status(order_id: int, change: StatusChange):
+    if change.status not in db_helper.ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Status must be one of {', '.join(db_helper.ORDER_TRANSITIONS)}")
+    changed = await transition_order(order_id, change.status)
+    if changed is None:
+        raise HTTPException(status_code=503, detail="Status change failed")
+    if not changed:
+        raise HTTPException(status_code=409, detail=f"Order {order_id} cannot move to {change.status}")
+    return {"order_id": order_id, "status": change.status}
+
+
+@app.get("/admin/sales", dependencies=[Depends(require_admin)])
+async def sales_summary(start: Optional[date] = None, end: Optional[date] = None,
+                        limit: int = Query(10, ge=1, le=100)):
+    """Revenue and cancellation rate per day and the best-selling items, from the sales rollups"""
+    summary = await async_db.sales_summary(start, end, limit)
+    if summary is None:
+        raise HTTPException(status_code=503, detail="Sales summary unavailable")
+    return summary
+
+
+ExportFormat = Query("csv", pattern="^(csv|ndjson)$")
+
+
+@app.get("/admin/exports/orders", dependencies=[Depends(require_admin)])
+async def export_orders(format: str = ExportFormat, start: Optional[date] = None, end: Optional[date] = None,
+                        status: Optional[str] = None):
+    """Order lines placed between ``start`` and ``end`` (inclusive), optionally with one tracking status"""
+    try:
+        return await exports.export_response(db_helper.stream_orders(start, end, status),
+                                             db_helper.ORDER_EXPORT_COLUMNS, format, "orders")
+    except Overloaded:
+        raise HTTPException(status_code=503, detail="Too many exports running, try again shortly")
+    except db_helper.DB_ERRORS as e:
+        logger.error("Order export failed: %s", e)
+        raise HTTPException(status_code=503, detail="Export failed")
+
+
+@app.get("/admin/exports/reservations", dependencies=[Depends(require_admin)])
+async def export_reservations(format: str = ExportFormat, start: Optional[date] = None,
+                              end: Optional[date] = None):
+    """Reservations for dates between ``start`` and ``end`` (inclusive)"""
+    try:
+        return await exports.export_response(db_helper.stream_reservations(start, end),
+                                             db_helper.RESERVATION_EXPORT_COLUMNS, format, "reservations")
+    except Overloaded:
+        raise HTTPException(status_code=503, detail="Too many exports running, try again shortly")
+    except db_helper.DB_ERRORS as e:
+        logger.error("Reservation export failed: %s", e)
+        raise HTTPException(status_code=503, detail="Export failed")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Some gauges read SQLite files, so render off the event loop
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type="text/plain; version=0.0.4")
+
+
+WARMUP_CONTEXT = "projects/warmup/agent/sessions/warmup/contexts/ongoing-order"
+
+
+def warmup_turns(item):
+    """One synthetic webhook turn per intent. None of them write anything: the
+    warmup cart is emptied again, the reservation has no name and every looked-up ID is -1"""
+    return [
+        ("order.add - context: ongoing-order", {"food-item": [item], "number": [1]}),
+        ("order.remove - context: ongoing-order", {"food-item": [item]}),
+        ("order.complete - context: ongoing-order", {}),
+        ("order.cancel - context: cancel-order", {"number": -1}),
+        ("track.order - context: ongoing-tracking", {"number": -1}),
+        ("book_reservation", {"date": "2000-01-01T00:00:00Z", "time": "2000-01-01T19:00:00Z"}),
+        ("check_reservation", {"id": -1}),
+        ("cancel_reservation", {"id": -1}),
+    ]
+
+
+warmup_state = {"warm": False, "seconds": None, "error": None}
+_warmup_lock = asyncio.Lock()
+# Last schema version /ready saw; it stops asking once the schema is current
+schema_state = {"version": None}
+
+
+async def _warm_handlers():
+    menu = await async_db.run(db_helper.menu_cache.items)
+    item = next(iter(menu.values())).name if menu else "warmup"
+    for intent, parameters in warmup_turns(item):
+        payload = WebhookRequest.model_validate({"queryResult": {
+            "intent": {"displayName": intent}, "parameters": parameters,
+            "outputContexts": [{"name": WARMUP_CONTEXT}]}})
+        await INTENT_HANDLERS[payload.intent](payload.parameters, payload.session_id)
+
+
+async def warm_up():
+    """Open pooled connections, reserve order IDs and run each intent handler once"""
+    async with _warmup_lock:
+        if warmup_state["warm"]:
+            return True
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(async_db.warm_up(), WARMUP_TIMEOUT)
+            if len(db_helper.menu_cache) == 0:
+                await async_db.refresh_menu()
+            await asyncio.wait_for(_warm_handlers(), WARMUP_TIMEOUT)
+        except (asyncio.TimeoutError, Overloaded, *db_helper.DB_ERRORS) as e:
+            warmup_state["error"] = str(e) or type(e).__name__
+            logger.warning("Warmup incomplete: %s", warmup_state["error"])
+            return False
+        warmup_state.update(warm=True, seconds=round(time.perf_counter() - started, 3), error=None)
+        logger.info("Warmup finished in %.3fs", warmup_state["seconds"])
+        return True
+
+
+async def _check_schema():
+    if schema_state["version"] != schema.LATEST_VERSION:
+        try:
+            schema_state["version"] = await async_db.run(schema.schema_version)
+        except Overloaded:
+            return {"ok": False, "busy": True}
+        except db_helper.DB_ERRORS as e:
+            return {"ok": False, "error": str(e)}
+    return {"ok": schema_state["version"] == schema.LATEST_VERSION,
+            "version": schema_state["version"], "latest": schema.LATEST_VERSION}
+
+
+@app.get("/live")
+async def live():
+    """Liveness: the event loop is answering; says nothing about the database"""
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: warmup has finished, the database answers and its schema is current"""
+    warm = warmup_state["warm"] or await warm_up()
+    checks = {}
+    try:
+        latency = await async_db.check_database()
+        checks["database"] = {"ok": True, "latency_ms": round(latency * 1000, 2)}
+    except Overloaded:
+        # A saturated worker is still healthy; pulling it would push its load onto the others
+        checks["database"] = {"ok": True, "busy": True}
+    except db_helper.DB_ERRORS as e:
+        checks["database"] = {"ok": False, "error": str(e)}
+    checks["schema"] = await _check_schema()
+    checks["menu"] = {"items": len(db_helper.menu_cache), "stale": db_helper.menu_cache.stale}
+    checks["order_queue"] = {"ok": order_queue.running, "depth": order_queue.depth()}
+
+    is_ready = warm and checks["database"]["ok"] and checks["schema"]["ok"] and checks["order_queue"]["ok"]
+    content = {"status": "ready" if is_ready else "unavailable", "warm": warm,
+               "warmup_seconds": warmup_state["seconds"], "warmup_error": warmup_state["error"],
+               "checks": checks}
+    return FastJSONResponse(content=content, status_code=200 if is_ready else 503)
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the chatbot API!"}
\ No newline at end of file
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from menu_index import MenuIndex
+
+logger = logging.getLogger(__name__)
+
+
+class MenuItem(NamedTuple):
+    item_id: int
+    name: str
+    price: object
+
+
+def normalize_name(name) -> str:
+    return " ".join(str(name).split()).lower()
+
+
+class MenuCache:
+    """In-process snapshot of the food_items table keyed by normalized name.
+
+    ``lookup`` tolerates plurals and small typos through a MenuIndex that is
+    rebuilt with every snapshot.
+
+    ``loader`` returns an iterable of ``(item_id, name, price)`` rows. The
+    snapshot is reloaded once it is older than ``ttl`` seconds or after
+    ``invalidate()``; ``version`` increases on every successful load so callers
+    can tell when derived data needs rebuilding.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[tuple]], ttl: float = 300.0, retry_after: float = 5.0):
+        self._loader = loader
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.version = 0
+        self._items: Dict[str, MenuItem] = {}
+        self._index = MenuIndex(())
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def lookup(self, name, refresh=True) -> Optional[MenuItem]:
+        """Resolve a typed name; pass ``refresh=False`` to use the current snapshot without reloading"""
+        if refresh and self._is_stale():
+            self.refresh()
+        return self._index.resolve(name)
+
+    @property
+    def stale(self) -> bool:
+        """True when the next lookup would reload the menu from the database"""
+        return self._is_stale()
+
+    def items(self) -> Dict[str, MenuItem]:
+        if self._is_stale():
+            self.refresh()
+        return self._items
+
+    def refresh(self, force=False) -> bool:
+        """Reload the snapshot; concurrent callers wait for a single load"""
+        with self._lock:
+            if not force and not self._is_stale():
+                return True
+            try:
+                rows = self._loader()
+            except Exception as err:
+                # Keep serving the previous snapshot rather than failing every lookup
+                logger.error("Menu cache refresh failed: %s", err)
+                if self._items:
+                    self._loaded_at = time.monotonic() - self.ttl + self.retry_after
+                return False
+            items = {normalize_name(name): MenuItem(item_id, name, price) for item_id, name, price in rows}
+            self._index = MenuIndex(items.values())
+            self._items = items
+            self._loaded_at = time.monotonic()
+            self.version += 1
+            logger.info("Menu cache loaded %s items (version %s)", len(self._items), self.version)
+            return True
+
+    def __len__(self):
+        return len(self._items)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
@@ -0,0 +1,121 @@
+"""Typo-tolerant lookup of menu item names.
+
+Dialogflow hands us whatever the customer typed ("pizzas", "samosaa",
+"Mango-Lassi"). Names are folded to a canonical key (case, accents,
+punctuation and a trailing plural "s" removed) for an exact dictionary hit;
+misses fall back to a trigram index that shortlists a few candidates, which
+are then checked with a bounded edit distance.
+"""
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+MAX_CANDIDATES = 5
+_MEMO_SIZE = 4096
+
+
+def fold(name) -> str:
+    """Canonical matching key: lowercase ASCII words with simple plurals singularized"""
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode().lower()
+    words = "".join(ch if ch.isalnum() else " " for ch in text).split()
+    return " ".join(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+                    for word in words)
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _allowed_edits(key):
+    return 0 if len(key) < 5 else max(1, len(key) // 4)
+
+
+def edit_distance(a, b, limit) -> int:
+    """Optimal string alignment distance between ``a`` and ``b``, or ``limit + 1`` once it exceeds ``limit``.
+
+    Only the diagonal band ``limit`` cells wide can stay within the limit, so
+    cells outside it are never computed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous2 = None
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        ca = a[i - 1]
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        for j in range(low, high + 1):
+            cb = b[j - 1]
+            value = previous[j - 1] if ca == cb else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if previous2 is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value if value < over else over
+        # A transposition can still lower the next row by reaching back past this one
+        if min(current) > limit and min(previous) >= limit:
+            return over
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class MenuIndex:
+    """Immutable name index over menu items; build a new one whenever the menu changes.
+
+    ``items`` maps any name of an item to the item itself; ``resolve`` returns
+    that item for a typed name, or None when nothing is close enough.
+    """
+
+    def __init__(self, items: Iterable):
+        self._exact: Dict[str, object] = {}
+        self._grams: Dict[str, list] = {}
+        self._gram_counts: Dict[str, int] = {}
+        for item in items:
+            key = fold(item.name)
+            if not key or key in self._exact:
+                continue
+            self._exact[key] = item
+            grams = _trigrams(key)
+            self._gram_counts[key] = len(grams)
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(key)
+        self._memo: Dict[str, Optional[object]] = {}
+
+    def resolve(self, name) -> Optional[object]:
+        memo = self._memo
+        if name in memo:
+            return memo[name]
+        key = fold(name)
+        item = self._exact.get(key)
+        if item is None and key:
+            item = self._closest(key)
+        if len(memo) >= _MEMO_SIZE:
+            memo.clear()
+        memo[name] = item
+        return item
+
+    def _closest(self, key):
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        best, best_distance = None, None
+        for candidate, count in shared.most_common(MAX_CANDIDATES):
+            limit = min(_allowed_edits(key), _allowed_edits(candidate))
+            # An edit destroys at most four trigrams (three, or four for a transposition),
+            # so fewer shared ones rule the candidate out
+            if count < max(len(grams), self._gram_counts[candidate]) - 4 * limit:
+                continue
+            distance = edit_distance(key, candidate, limit)
+            if distance <= limit and (best_distance is None or distance < best_distance):
+                best, best_distance = candidate, distance
+        return self._exact.get(best)
+
+    def __len__(self):
+        return len(self._exact)
@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Callable, List, NamedTuple
+
+from db_helper import PricedLine, PricedOrder
+
+logger = logging.getLogger(__name__)
+
+ORDER_QUEUE_PATH = os.getenv("ORDER_QUEUE_PATH", "order_queue.db")
+ORDER_QUEUE_BATCH_SIZE = int(os.getenv("ORDER_QUEUE_BATCH_SIZE", "50"))
+ORDER_QUEUE_MAX_ATTEMPTS = int(os.getenv("ORDER_QUEUE_MAX_ATTEMPTS", "10"))
+
+
+class QueuedOrder(NamedTuple):
+    order_id: int
+    priced_order: PricedOrder
+    placed_at: float
+
+
+def _encode(priced_order: PricedOrder) -> str:
+    return json.dumps({
+        "lines": [[line.item_id, line.quantity, str(line.unit_price), str(line.line_total)]
+                  for line in priced_order.lines],
+        "total": str(priced_order.total),
+        "missing": list(priced_order.missing),
+    })
+
+
+def _decode(payload: str) -> PricedOrder:
+    data = json.loads(payload)
+    lines = tuple(PricedLine(item_id, quantity, Decimal(unit_price), Decimal(line_total))
+                  for item_id, quantity, unit_price, line_total in data["lines"])
+    return PricedOrder(lines, Decimal(data["total"]), tuple(data["missing"]))
+
+
+class OrderQueue:
+    """Durable write-behind queue for confirmed orders.
+
+    ``enqueue`` appends an order to a SQLite journal and fsyncs it before
+    returning, so an order survives a restart once the customer has been given
+    its ID. A background thread claims up to ``batch_size`` journaled orders at
+    a time and passes them to ``writer``, which must persist the whole batch in
+    one transaction and return a dict with an ``"error"`` key on failure.
+    Claims expire after ``lease`` seconds, so orders left behind by a crashed
+    worker are replayed by whichever process drains the journal next.
+
+    ``depth()`` answers from memory, so it is safe to call on the event loop.
+    The count follows this process's own writes and is recounted from the
+    journal, which other processes may share, whenever the worker goes idle.
+    """
+
+    def __init__(self, writer: Callable[[List[QueuedOrder]], dict], path=ORDER_QUEUE_PATH,
+                 batch_size=ORDER_QUEUE_BATCH_SIZE, max_attempts=ORDER_QUEUE_MAX_ATTEMPTS,
+                 lease=60.0, idle_wait=1.0, retry_wait=1.0):
+        self._writer = writer
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.idle_wait = idle_wait
+        self.retry_wait = retry_wait
+
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        # Notified whenever orders leave the journal
+        self._drained = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.committed_orders = 0
+        self.committed_batches = 0
+        self.failed_batches = 0
+        self.dead_orders = 0
+        self.last_batch_size = 0
+        self._retrying = False
+        self._depth = 0
+
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Every enqueue must reach the disk before the webhook answers
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS order_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                placed_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                dead INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+    def enqueue(self, order_id: int, priced_order: PricedOrder):
+        with self._lock:
+            self._conn.execute("INSERT INTO order_journal (order_id, payload, placed_at) VALUES (?, ?, ?)",
+                               (order_id, _encode(priced_order), time.time()))
+            self._depth += 1
+        self._wakeup.set()
+
+    def depth(self) -> int:
+        """Journaled orders not yet committed or dead-lettered, without touching the journal"""
+        # Orders another process journaled are only counted at the next recount
+        return max(self._depth, 0)
+
+    def flush(self, order_id: int, timeout=5.0) -> bool:
+        """Wait until ``order_id`` is no longer waiting in the journal, so it can be changed in the database.
+
+        Returns False when it is still journaled after ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        query = "SELECT 1 FROM order_journal WHERE order_id = ? AND dead = 0"
+        with self._drained:
+            while self._conn.execute(query, (order_id,)).fetchone() is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._wakeup.set()
+                # Another process draining the same journal does not notify us, so look again now and then
+                self._drained.wait(min(remaining, 0.1))
+        return True
+
+    def _recount(self) -> int:
+        with self._lock:
+            self._depth = self._conn.execute("SELECT COUNT(*) FROM order_journal WHERE dead = 0").fetchone()[0]
+            return self._depth
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "last_batch_size": self.last_batch_size,
+            "committed_orders": self.committed_orders,
+            "committed_batches": self.committed_batches,
+            "failed_batches": self.failed_batches,
+            "dead_orders": self.dead_orders,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start draining the journal, replaying anything left from a previous run"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="order-queue", daemon=True)
+        self._thread.start()
+        pending = self._recount()
+        if pending:
+            logger.info("Replaying %s journaled orders", pending)
+
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain_once(self) -> int:
+        """Claim and commit a single batch; returns the number of orders committed"""
+        batch = self._claim()
+        if not batch:
+            return 0
+
+        orders = [order for _, order in batch]
+        result = self._writer(orders)
+        self._retrying = False
+        if "error" not in result:
+            self._complete([seq for seq, _ in batch])
+            self._record_commit(len(batch))
+            return len(batch)
+
+        self.failed_batches += 1
+        logger.error("Group commit of %s orders failed: %s", len(batch), result['error'])
+        if len(batch) == 1:
+            self._release(batch)
+            self._retrying = True
+            return 0
+
+        # Commit the rest of the batch one by one so a single bad order cannot block it
+        committed = 0
+        for seq, order in batch:
+            if "error" in self._writer([order]):
+                self._release([(seq, order)])
+            else:
+                self._complete([seq])
+                self._record_commit(1)
+                committed += 1
+        self._retrying = committed == 0
+        return committed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                committed = self.drain_once()
+            except Exception as err:
+                logger.error("Order queue worker error: %s", err)
+                committed = 0
+            if committed:
+                continue
+            if self._retrying:
+                # Back off while the database is failing instead of hammering it
+                self._stopping.wait(self.retry_wait)
+                continue
+            try:
+                self._recount()
+            except sqlite3.Error as err:
+                logger.error("Could not count journaled orders: %s", err)
+            self._wakeup.wait(self.idle_wait)
+            self._wakeup.clear()
+        # Flush what is left before shutting down
+        while self.drain_once():
+            pass
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("""
+                    SELECT seq, order_id, payload, placed_at FROM order_journal
+                    WHERE dead = 0 AND (claimed_by IS NULL OR claimed_at < ?)
+                    ORDER BY seq LIMIT ?
+                """, (now - self.lease, self.batch_size)).fetchall()
+                if rows:
+                    self._conn.executemany("UPDATE order_journal SET claimed_by = ?, claimed_at = ? WHERE seq = ?",
+                                           [(self._owner, now, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(seq, QueuedOrder(order_id, _decode(payload), placed_at))
+                for seq, order_id, payload, placed_at in rows]
+
+    def _complete(self, seqs):
+        with self._lock:
+            self._conn.executemany("DELETE FROM order_journal WHERE seq = ?", [(seq,) for seq in seqs])
+            self._depth -= len(seqs)
+            self._drained.notify_all()
+
+    def _release(self, batch):
+        """Hand failed orders back to the journal, dead-lettering them after too many attempts"""
+        with self._lock:
+            for seq, order in batch:
+                self._conn.execute("""
+                    UPDATE order_journal
+                    SET attempts = attempts + 1, claimed_by = NULL, claimed_at = NULL,
+                        dead = CASE WHEN attempts + 1 >= ? THEN 1 ELSE 0 END
+                    WHERE seq = ?
+                """, (self.max_attempts, seq))
+                attempts, dead = self._conn.execute("SELECT attempts, dead FROM order_journal WHERE seq = ?",
+                                                    (seq,)).fetchone()
+                if dead:
+                    self.dead_orders += 1
+                    self._depth -= 1
+                    self._drained.notify_all()
+                    logger.error("Order #%s failed %s times and was dead-lettered", order.order_id, attempts)
+
+    def _record_commit(self, count):
+        self.committed_orders += count
+        self.committed_batches += 1
+        self.last_batch_size = count
@@ -0,0 +1,92 @@
+"""scrypt password hashing, run off the event loop on a small dedicated thread pool.
+
+Hashes are stored as ``$scrypt$ln=14,r=8,p=1$<salt>$<hash>`` (base64 without
+padding), so the cost parameters can be raised later without invalidating
+existing hashes. hashlib releases the GIL while scrypt runs, so threads
+hash in parallel; the pool size bounds the CPU and memory spent on
+signups, and admission control sheds signups that would queue too long.
+"""
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from admission import AdmissionController
+
+# Cost parameters for new hashes: N = 2**SCRYPT_LOG_N, block size r, parallelism p
+SCRYPT_LOG_N = int(os.getenv("SCRYPT_LOG_N", "14"))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "2.0"))
+# Signups can wait longer than webhook turns, so allow a deeper queue than the database gets
+HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", "100"))
+
+_executor = None
+admission = AdmissionController(
+    HASH_WORKERS, queue_timeout=HASH_QUEUE_TIMEOUT, max_waiting=HASH_MAX_WAITING,
+    shed=metrics.Counter("password_hash_shed_total", "Password hashes rejected by admission control",
+                         ("function", "reason")),
+    wait=metrics.Histogram("password_hash_wait_seconds", "Time password hashes waited for a KDF worker"))
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 1 << log_n
+    # scrypt needs 128 * r * N bytes; leave headroom over hashlib's 32 MiB default
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=256 * r * n + 1024 * 1024)
+
+
+def hash_password_sync(password) -> str:
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+    return f"$scrypt$ln={SCRYPT_LOG_N},r={SCRYPT_R},p={SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password_sync(password, encoded) -> bool:
+    try:
+        _, scheme, params, salt, key = encoded.split("$")
+        settings = dict(item.split("=") for item in params.split(","))
+        if scheme != "scrypt":
+            return False
+        expected = _unb64(key)
+        actual = _scrypt(password, _unb64(salt), int(settings["ln"]), int(settings["r"]), int(settings["p"]))
+    except (ValueError, KeyError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="kdf")
+    return _executor
+
+
+async def hash_password(password) -> str:
+    """Hash ``password`` on the KDF pool; raises Overloaded when the pool is backed up"""
+    return await admission.run(_get_executor(), hash_password_sync, password)
+
+
+async def verify_password(password, encoded) -> bool:
+    return await admission.run(_get_executor(), verify_password_sync, password, encoded)
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
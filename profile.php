@@ -6,7 +6,7 @@ if (!is_logged_in()) {
     header("Location: index.php");
     exit;
 }
-$stmt = $pdo->prepare("SELECT * FROM users WHERE id = ?");
+$stmt = $pdo->prepare("SELECT * FROM users WHERE user_id = ?");
 $stmt->execute([$_SESSION['user_id']]);
 $user = $stmt->fetch();
 ?>
@@ -17,7 +17,7 @@ $user = $stmt->fetch();
 </form>
 <?php
 if ($_SERVER['REQUEST_METHOD'] === 'POST') {
-    $stmt = $pdo->prepare("UPDATE users SET username = ?, email = ? WHERE id = ?");
+    $stmt = $pdo->prepare("UPDATE users SET username = ?, email = ? WHERE user_id = ?");
     $stmt->execute([$_POST['username'], $_POST['email'], $_SESSION['user_id']]);
     echo "Updated successfully!";
 }
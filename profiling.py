@@ -0,0 +1,248 @@
+"""Opt-in per-request query tracing, N+1 detection and slow-request profiles.
+
+A request is traced when its ``X-Profile`` header matches PROFILE_TOKEN or
+when it falls in the PROFILE_SAMPLE_RATE sample. While a trace is active,
+every cursor handed out by db_helper records each statement, the types of
+its parameters and how long it took. A statement run PROFILE_REPEAT_THRESHOLD
+or more times in one trace is logged as an N+1 candidate.
+
+With PROFILE_DIR set, each trace is also written there as JSON. Traced
+requests slower than PROFILE_SLOW_MS add a cProfile dump and a tracemalloc
+snapshot. The profiler sees the whole event loop thread, so other requests
+interleaved with the slow one show up in its profile too. Only one
+request is profiled at a time. Files are written by a background thread,
+so a traced request never waits on the disk.
+"""
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import orjson
+
+import metrics
+import structured_logging
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_REPEAT_THRESHOLD = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "3"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+
+logger = logging.getLogger(__name__)
+
+REPEATED = metrics.Counter("query_trace_repeated_statements_total",
+                           "Statements flagged as N+1 candidates in traced requests", ("trace",))
+
+_current = contextvars.ContextVar("query_trace", default=None)
+_capture_lock = threading.Lock()
+_writer = None
+_whitespace = re.compile(r"\s+")
+
+
+class QueryTrace:
+    """Statements executed while one request or batch was traced"""
+
+    def __init__(self, label):
+        self.label = label
+        # (sql, parameter shape, seconds) in execution order
+        self.statements = []
+
+    def record(self, sql, shape, seconds):
+        self.statements.append((_whitespace.sub(" ", sql).strip(), shape, seconds))
+
+    @property
+    def db_seconds(self):
+        return sum(seconds for _, _, seconds in self.statements)
+
+    def repeated(self, threshold=PROFILE_REPEAT_THRESHOLD):
+        """(sql, count, seconds) for every statement run at least ``threshold`` times"""
+        totals = {}
+        for sql, _, seconds in self.statements:
+            count, spent = totals.get(sql, (0, 0.0))
+            totals[sql] = (count + 1, spent + seconds)
+        return [(sql, count, spent) for sql, (count, spent) in totals.items() if count >= threshold]
+
+
+def _shape(params):
+    if params is None:
+        return ""
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+
+class _TracedCursor:
+    def __init__(self, cursor, trace):
+        self._cursor = cursor
+        self._trace = trace
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params, *args, **kwargs)
+        finally:
+            self._trace.record(sql, _shape(params), time.perf_counter() - started)
+
+    def executemany(self, sql, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_params, *args, **kwargs)
+        finally:
+            shape = f"{len(seq_params)} x {_shape(seq_params[0])}" if seq_params else "0 rows"
+            self._trace.record(sql, shape, time.perf_counter() - started)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TracedConnection:
+    def __init__(self, cnx, trace):
+        self._cnx = cnx
+        self._trace = trace
+
+    def cursor(self, *args, **kwargs):
+        return _TracedCursor(self._cnx.cursor(*args, **kwargs), self._trace)
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+
+def traced_connection(cnx):
+    """``cnx``, recording its statements when a trace is active in this context"""
+    trace = _current.get()
+    return cnx if trace is None else _TracedConnection(cnx, trace)
+
+
+def traced_cursor(cursor):
+    """``cursor``, recording its statements when a trace is active in this context"""
+    trace = _current.get()
+    return cursor if trace is None else _TracedCursor(cursor, trace)
+
+
+def untraced(cnx):
+    """The driver connection behind a connection returned by traced_connection()"""
+    return cnx._cnx if isinstance(cnx, _TracedConnection) else cnx
+
+
+def wanted(header_value=None) -> bool:
+    """Should the current request be traced?"""
+    if PROFILE_TOKEN and header_value == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start_capture():
+    """Start cProfile and tracemalloc unless another request already holds them"""
+    if not PROFILE_DIR or not _capture_lock.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    profile.enable()
+    return profile, started_tracemalloc
+
+
+def _finish_capture(capture, keep):
+    """Stop profiling; returns the (profile, tracemalloc snapshot) pair when ``keep``"""
+    profile, started_tracemalloc = capture
+    try:
+        profile.disable()
+        return (profile, tracemalloc.take_snapshot()) if keep else None
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _capture_lock.release()
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+    return _writer
+
+
+def _write(path, trace, repeated, elapsed, captured):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(f"{path}.trace.json", "wb") as out:
+            out.write(orjson.dumps({
+                "label": trace.label,
+                "elapsed_ms": elapsed * 1000,
+                "statements": [{"sql": sql, "params": shape, "ms": seconds * 1000}
+                               for sql, shape, seconds in trace.statements],
+                "repeated": [{"sql": sql, "count": count, "ms": spent * 1000}
+                             for sql, count, spent in repeated],
+            }, option=orjson.OPT_INDENT_2))
+        if captured is not None:
+            profile, snapshot = captured
+            profile.dump_stats(f"{path}.prof")
+            snapshot.dump(f"{path}.tracemalloc")
+    except OSError as err:
+        logger.error("Could not write profile for %s: %s", trace.label, err)
+
+
+def shutdown(wait=True):
+    """Stop the profile writer, by default after it has written what is queued"""
+    global _writer
+    if _writer is not None:
+        _writer.shutdown(wait=wait)
+        _writer = None
+
+
+def _report(trace, elapsed, capture):
+    repeated = trace.repeated()
+    logger.info("Query trace %s: %s statements, %.1f ms in the database of %.1f ms",
+                trace.label, len(trace.statements), trace.db_seconds * 1000, elapsed * 1000)
+    for sql, count, spent in repeated:
+        REPEATED.inc(trace.label)
+        logger.warning("Possible N+1 in %s: %s runs, %.1f ms: %s", trace.label, count, spent * 1000, sql)
+
+    path = None
+    if PROFILE_DIR:
+        name = structured_logging.request_id.get() or f"{threading.get_ident():x}"
+        path = os.path.join(PROFILE_DIR, f"{time.time():.0f}-{name}")
+    captured = None
+    if capture is not None:
+        captured = _finish_capture(capture, path is not None and elapsed * 1000 >= PROFILE_SLOW_MS)
+    if path is not None:
+        _get_writer().submit(_write, path, trace, repeated, elapsed, captured)
+
+
+@contextmanager
+def trace(label, capture=True):
+    """Trace the statements run inside the block; ``capture`` also profiles it when slow"""
+    query_trace = QueryTrace(label)
+    token = _current.set(query_trace)
+    profile = _start_capture() if capture else None
+    started = time.perf_counter()
+    try:
+        yield query_trace
+    finally:
+        _current.reset(token)
+        _report(query_trace, time.perf_counter() - started, profile)
+
+
+def maybe_trace(label, header_value=None):
+    """trace(label) when wanted(header_value), otherwise a context manager that does nothing"""
+    return trace(label) if wanted(header_value) else nullcontext()
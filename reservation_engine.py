@@ -0,0 +1,225 @@
+"""Table capacity for reservations, answered from an in-memory index of booked seats.
+
+Each date is split into fixed slots between opening and closing time, and a
+booking holds ``party_size`` seats in every slot its sitting overlaps. The
+index for a date is loaded from ``reservations`` the first time it is
+needed and then updated in place by every booking and cancellation, so
+availability checks and alternative suggestions never touch the database.
+
+Several workers each keep their own index. Every write bumps the date's row
+in ``reservation_versions``, and a booking only commits when that version
+still matches the one its index was built from; otherwise the date is
+reloaded and the booking re-checked. Before turning a party away, the
+version is read once more so a cancellation on another worker is not missed.
+"""
+import datetime
+import logging
+import os
+import threading
+from typing import List, NamedTuple, Optional
+
+import db_helper
+import metrics
+import statements
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SEATING_CAPACITY = int(os.getenv("RESERVATION_CAPACITY", "40"))
+SLOT_MINUTES = int(os.getenv("RESERVATION_SLOT_MINUTES", "30"))
+SITTING_MINUTES = int(os.getenv("RESERVATION_SITTING_MINUTES", "90"))
+OPENS = os.getenv("RESERVATION_OPENS", "11:00")
+CLOSES = os.getenv("RESERVATION_CLOSES", "23:00")
+DEFAULT_PARTY_SIZE = int(os.getenv("RESERVATION_DEFAULT_PARTY_SIZE", "2"))
+# Upper bound on how long another worker's bookings can go unseen by this one
+INDEX_TTL = float(os.getenv("RESERVATION_INDEX_TTL", "300"))
+BOOKING_ATTEMPTS = 3
+
+
+class Booking(NamedTuple):
+    # Set when the booking was committed
+    reservation_id: Optional[int]
+    # Nearest free start times on the same date when the requested one is full
+    alternatives: List[datetime.time]
+
+
+class _Day:
+    __slots__ = ("seats", "version")
+
+    def __init__(self, seats, version):
+        self.seats = seats
+        self.version = version
+
+
+def _minutes(value) -> int:
+    """Minutes after midnight of a TIME value as MySQL (timedelta), SQLite (str) or Python returns it"""
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds()) // 60
+    if isinstance(value, str):
+        value = datetime.time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes) -> datetime.time:
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+class ReservationEngine:
+    def __init__(self, capacity=SEATING_CAPACITY, slot_minutes=SLOT_MINUTES, sitting_minutes=SITTING_MINUTES,
+                 opens=OPENS, closes=CLOSES, index_ttl=INDEX_TTL):
+        self.capacity = capacity
+        self.slot_minutes = slot_minutes
+        self.opens = _minutes(opens)
+        self.closes = _minutes(closes)
+        self.slots = (self.closes - self.opens) // slot_minutes
+        self.sitting_minutes = sitting_minutes
+        self._days = TTLCache(max_size=400, ttl=index_ttl)
+        self._lock = threading.Lock()
+        self.conflicts = 0
+
+    def _span(self, minutes):
+        """First slot a sitting starting at ``minutes`` overlaps, and the slot after its last one"""
+        start = (minutes - self.opens) // self.slot_minutes
+        # Rounded up, so a sitting that starts between slot boundaries still claims the slot it ends in
+        end = -(-(minutes + self.sitting_minutes - self.opens) // self.slot_minutes)
+        return start, end
+
+    def _fits(self, day, minutes, party_size):
+        start, end = self._span(minutes)
+        if start < 0 or end > self.slots:
+            return False
+        return all(day.seats[i] + party_size <= self.capacity for i in range(start, end))
+
+    def _apply(self, day, minutes, party_size):
+        start, end = self._span(minutes)
+        # Rows booked before the opening hours changed may fall partly outside them
+        for i in range(max(start, 0), min(end, self.slots)):
+            day.seats[i] += party_size
+
+    def _load(self, cnx, date):
+        with cnx.cursor() as cursor:
+            cursor.execute(f"{db_helper.backend.insert_ignore} INTO reservation_versions (reservation_date, version) "
+                           "VALUES (%s, 0)", (date,))
+        day = _Day([0] * self.slots, db_helper.query_one(cnx, statements.RESERVATION_VERSION, (date,))[0])
+        for time, party_size in db_helper.query_all(cnx, statements.DAY_RESERVATIONS, (date,)):
+            self._apply(day, _minutes(time), party_size)
+        with self._lock:
+            self._days.set(date, day)
+        return day
+
+    def _day(self, date):
+        day = self._days.get(date)
+        if day is not None:
+            return day
+        with db_helper.get_db_connection() as cnx:
+            day = self._load(cnx, date)
+            cnx.commit()
+        return day
+
+    def _stale(self, date, version):
+        """Reload ``date`` and return True if the database has moved past ``version``"""
+        with db_helper.get_db_connection() as cnx:
+            row = db_helper.query_one(cnx, statements.RESERVATION_VERSION, (date,))
+            if row is None or row[0] == version:
+                return False
+            self._load(cnx, date)
+            cnx.commit()
+        return True
+
+    def is_free(self, date, time, party_size) -> bool:
+        day = self._day(date)
+        with self._lock:
+            return self._fits(day, _minutes(time), party_size)
+
+    def suggest(self, date, time, party_size, limit=3) -> List[datetime.time]:
+        """Free start times on ``date`` closest to ``time``, earlier first on ties"""
+        day = self._day(date)
+        wanted = _minutes(time)
+        with self._lock:
+            starts = [start for start in range(self.opens, self.closes, self.slot_minutes)
+                      if self._fits(day, start, party_size)]
+        starts.sort(key=lambda start: (abs(start - wanted), start))
+        return [_time(start) for start in starts[:limit]]
+
+    @metrics.instrumented
+    def book_reservation(self, customer_name, date, time, party_size) -> Optional[Booking]:
+        """Book a table if the slot has room; returns None when the database write fails"""
+        try:
+            for _ in range(BOOKING_ATTEMPTS):
+                day = self._day(date)
+                minutes = _minutes(time)
+                with self._lock:
+                    fits = self._fits(day, minutes, party_size)
+                    version = day.version
+                if not fits:
+                    # A cancellation on another worker may have freed the slot; one cheap
+                    # primary-key read tells whether this index is behind before turning anyone away
+                    if self._stale(date, version):
+                        continue
+                    return Booking(None, self.suggest(date, time, party_size))
+
+                with db_helper.get_db_connection() as cnx:
+                    claim = db_helper.run_statement(cnx, statements.CLAIM_RESERVATION_VERSION, (date, version))
+                    if claim.rowcount != 1:
+                        # Booked or cancelled elsewhere since the index was built
+                        self.conflicts += 1
+                        cnx.rollback()
+                        self._load(cnx, date)
+                        cnx.commit()
+                        continue
+                    reservation_id = db_helper.run_statement(
+                        cnx, statements.INSERT_RESERVATION, (customer_name, date, time, party_size)).lastrowid
+                    cnx.commit()
+
+                with self._lock:
+                    if day.version == version:
+                        self._apply(day, minutes, party_size)
+                        day.version = version + 1
+                    else:
+                        self._days.pop(date)
+                db_helper.reservation_fallback.set(reservation_id, {
+                    "reservation_id": reservation_id, "customer_name": customer_name,
+                    "reservation_date": date, "time": time, "party_size": party_size})
+                return Booking(reservation_id, [])
+
+            logger.warning("Gave up booking %s %s after %s conflicting writes", date, time, BOOKING_ATTEMPTS)
+            return None
+        except db_helper.DB_ERRORS as err:
+            logger.error("Insert reservation error: %s", err)
+            return None
+
+    @metrics.instrumented
+    def cancel_reservation(self, reservation_id: int) -> bool:
+        try:
+            with db_helper.get_db_connection() as cnx:
+                row = db_helper.query_one(cnx, statements.RESERVATION_SLOT, (reservation_id,))
+                if row is None:
+                    return False
+                date, time, party_size = row
+                db_helper.run_statement(cnx, statements.DELETE_RESERVATION, (reservation_id,))
+                db_helper.run_statement(cnx, statements.BUMP_RESERVATION_VERSION, (date,))
+                version = db_helper.query_one(cnx, statements.RESERVATION_VERSION, (date,))
+                cnx.commit()
+        except db_helper.DB_ERRORS as err:
+            logger.error("Cancel reservation error: %s", err)
+            return False
+
+        db_helper.reservation_fallback.pop(reservation_id)
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        with self._lock:
+            day = self._days.get(date)
+            if day is None:
+                pass
+            elif version is not None and day.version + 1 == version[0]:
+                self._apply(day, _minutes(time), -party_size)
+                day.version = version[0]
+            else:
+                self._days.pop(date)
+        return True
+
+
+engine = ReservationEngine()
+
+metrics.Gauge("reservation_version_conflicts_total", "Bookings retried because another worker wrote the date first",
+              lambda: engine.conflicts, kind="counter")
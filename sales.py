@@ -0,0 +1,83 @@
+"""Read side of the daily sales rollups, for the dashboard and ops.
+
+The sales_daily and sales_daily_items tables are updated in the same
+transaction as the orders they count (see ``db_helper.add_sales``), so
+reads never scan the orders table. Results are cached for SALES_CACHE_TTL
+seconds. Run ``python sales.py`` to recompute the rollups from scratch
+after a backfill or a manual data fix.
+"""
+import logging
+import os
+from datetime import date, timedelta
+
+import db_helper
+import metrics
+import statements
+from ttl_cache import TTLCache
+
+SALES_CACHE_TTL = float(os.getenv("SALES_CACHE_TTL", "60"))
+DEFAULT_DAYS = 30
+
+logger = logging.getLogger(__name__)
+
+_summaries = TTLCache(max_size=256, ttl=SALES_CACHE_TTL)
+
+
+def _ratio(part, whole):
+    return float(part) / float(whole) if whole else 0.0
+
+
+@metrics.instrumented
+def sales_summary(start=None, end=None, limit=10):
+    """Revenue and cancellation rate per day plus the ``limit`` best-selling items, or None on a database error.
+
+    ``end`` defaults to today and ``start`` to DEFAULT_DAYS days before it, both inclusive.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=DEFAULT_DAYS - 1)
+    key = (start, end, limit)
+    summary = _summaries.get(key)
+    if summary is not None:
+        return summary
+    try:
+        with db_helper.get_db_connection() as cnx:
+            days = db_helper.query_all(cnx, statements.SALES_DAYS, (start, end))
+            items = db_helper.query_all(cnx, statements.SALES_TOP_ITEMS, (start, end, limit))
+    except db_helper.DB_ERRORS as err:
+        logger.error("Sales summary failed: %s", err)
+        return None
+
+    for day in days:
+        day["net_revenue"] = day["revenue"] - day["cancelled_revenue"]
+        day["cancellation_rate"] = _ratio(day["cancelled_orders"], day["orders"])
+    for item in items:
+        item["cancellation_rate"] = _ratio(item["cancelled_quantity"], item["quantity"])
+    orders = sum(day["orders"] for day in days)
+    cancelled = sum(day["cancelled_orders"] for day in days)
+    summary = {
+        "start": start,
+        "end": end,
+        "orders": orders,
+        "revenue": sum(day["revenue"] for day in days),
+        "net_revenue": sum(day["net_revenue"] for day in days),
+        "cancellation_rate": _ratio(cancelled, orders),
+        "days": days,
+        "top_items": items,
+    }
+    _summaries.set(key, summary)
+    return summary
+
+
+def rebuild():
+    """Recompute both rollups in one transaction and drop cached summaries"""
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            db_helper.rebuild_sales_rollups(cursor)
+        cnx.commit()
+    _summaries.clear()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    rebuild()
+    logger.info("Sales rollups rebuilt")
@@ -0,0 +1,299 @@
+"""Versioned schema for the tables the chatbot service reads and writes.
+
+Migrations are applied in order and recorded in ``schema_migrations``, so
+``migrate()`` is safe to run on every startup. Tables are created with
+``IF NOT EXISTS`` and indexes only when missing, which lets the first
+migration adopt databases that were created by hand before the service
+owned its schema.
+"""
+import logging
+import time
+from datetime import date
+
+import db_helper
+import statements
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(Exception):
+    """A migration cannot be applied until the data is fixed by hand"""
+
+
+def _tables(backend):
+    autoincrement = backend.autoincrement_primary_key
+    return [
+        """CREATE TABLE IF NOT EXISTS food_items (
+            item_id INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            price DECIMAL(10, 2) NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS orders (
+            order_id INT NOT NULL,
+            item_id INT NOT NULL,
+            quantity INT NOT NULL,
+            total_price DECIMAL(10, 2) NOT NULL,
+            PRIMARY KEY (order_id, item_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS order_tracking (
+            order_id INT PRIMARY KEY,
+            status VARCHAR(255) NOT NULL
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS reservations (
+            reservation_id {autoincrement},
+            customer_name VARCHAR(255) NOT NULL,
+            reservation_date DATE NOT NULL,
+            time TIME NOT NULL
+        )""",
+        # username is written by /register, name and phone by register.php; login.php reads user_id and role
+        f"""CREATE TABLE IF NOT EXISTS users (
+            user_id {autoincrement},
+            username VARCHAR(255),
+            name VARCHAR(255),
+            email VARCHAR(255) NOT NULL,
+            phone VARCHAR(64),
+            password VARCHAR(255) NOT NULL,
+            role VARCHAR(32) NOT NULL DEFAULT 'customer'
+        )""",
+        """CREATE TABLE IF NOT EXISTS id_sequences (
+            name VARCHAR(64) PRIMARY KEY,
+            next_value BIGINT NOT NULL
+        )""",
+    ]
+
+
+def _indexes(backend):
+    """(table, leading column, index name, CREATE INDEX statement) for every index the hot queries need.
+
+    Lookup indexes on a column are skipped when an existing index, usually the
+    primary key, already leads with that column. Unique indexes are matched
+    by name.
+    """
+    return [
+        ("orders", "order_id", "idx_orders_order_id", "CREATE INDEX idx_orders_order_id ON orders (order_id)"),
+        ("order_tracking", "order_id", "idx_order_tracking_order_id",
+         "CREATE INDEX idx_order_tracking_order_id ON order_tracking (order_id)"),
+        ("reservations", "reservation_id", "idx_reservations_reservation_id",
+         "CREATE INDEX idx_reservations_reservation_id ON reservations (reservation_id)"),
+        ("food_items", "name", "idx_food_items_name", "CREATE INDEX idx_food_items_name ON food_items (name)"),
+        ("users", None, "ux_users_email", "CREATE UNIQUE INDEX ux_users_email ON users (email)"),
+    ]
+
+
+def _create_tables(cursor, backend):
+    for statement in _tables(backend):
+        cursor.execute(statement)
+
+
+def _check_unique_emails(cursor):
+    cursor.execute("SELECT COUNT(*) FROM (SELECT email FROM users GROUP BY email HAVING COUNT(*) > 1) d")
+    duplicated = cursor.fetchone()[0]
+    if duplicated:
+        raise SchemaError(f"{duplicated} email addresses are shared by more than one user; "
+                          "merge or remove those rows so ux_users_email can be created")
+
+
+def _create_indexes(cursor, backend):
+    for table, column, index, statement in _indexes(backend):
+        if column is not None and column in backend.leading_index_columns(cursor, table):
+            continue
+        if not backend.index_exists(cursor, table, index):
+            if index == "ux_users_email":
+                # The migration stays pending, and is retried on the next startup
+                _check_unique_emails(cursor)
+            logger.info("Creating index %s on %s", index, table)
+            cursor.execute(statement)
+
+
+def _reservation_capacity(cursor, backend):
+    if not backend.column_exists(cursor, "reservations", "party_size"):
+        cursor.execute("ALTER TABLE reservations ADD COLUMN party_size INT NOT NULL DEFAULT 2")
+    if not backend.index_exists(cursor, "reservations", "idx_reservations_date"):
+        cursor.execute("CREATE INDEX idx_reservations_date ON reservations (reservation_date)")
+    # Bumped by every booking and cancellation on a date, so workers can detect stale slot indexes
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reservation_versions (
+            reservation_date DATE PRIMARY KEY,
+            version BIGINT NOT NULL
+        )
+    """)
+
+
+def _order_placed_at(cursor, backend):
+    # SQLite cannot add a column with a CURRENT_TIMESTAMP default, so writers set it explicitly
+    if not backend.column_exists(cursor, "order_tracking", "placed_at"):
+        cursor.execute("ALTER TABLE order_tracking ADD COLUMN placed_at DATETIME NULL")
+    if not backend.index_exists(cursor, "order_tracking", "idx_order_tracking_placed_at"):
+        cursor.execute("CREATE INDEX idx_order_tracking_placed_at ON order_tracking (placed_at)")
+
+
+def _sales_rollups(cursor, backend):
+    # Kept current by the order write path; db_helper.rebuild_sales_rollups backfills them
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            sales_date DATE PRIMARY KEY,
+            orders INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            cancelled_orders INT NOT NULL DEFAULT 0,
+            cancelled_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily_items (
+            sales_date DATE NOT NULL,
+            item_id INT NOT NULL,
+            quantity INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            cancelled_quantity INT NOT NULL DEFAULT 0,
+            cancelled_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (sales_date, item_id)
+        )
+    """)
+    db_helper.rebuild_sales_rollups(cursor)
+
+
+# (version, description, apply(cursor, backend)); append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "indexes for hot queries", _create_indexes),
+    (3, "reservation party size and per-date versions", _reservation_capacity),
+    (4, "order placement time", _order_placed_at),
+    (5, "daily sales rollups", _sales_rollups),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT IFNULL(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def schema_version() -> int:
+    """Version recorded in the database; raises a database error before the first migration"""
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            return current_version(cursor)
+
+
+def migrate():
+    """Apply every pending migration and return the resulting schema version"""
+    backend = db_helper.backend
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at DOUBLE NOT NULL
+                )
+            """)
+            version = current_version(cursor)
+            for target, description, apply in MIGRATIONS:
+                if target <= version:
+                    continue
+                logger.info("Applying schema migration %s: %s", target, description)
+                # MySQL commits DDL implicitly, so each step must be safe to re-run
+                apply(cursor, backend)
+                try:
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                        (target, description, time.time()))
+                    cnx.commit()
+                except backend.integrity_error:
+                    # Another worker recorded the same migration first
+                    cnx.rollback()
+                version = target
+    return version
+
+
+# Sample parameters for EXPLAIN, for every statement registered in statements.py.
+# A statement registered without an entry here fails at import
+_SAMPLE_PARAMS = {
+    "menu_items": (),
+    "update_menu_price": (1, "pizza"),
+    "next_item_id": (),
+    "order_total": (1,),
+    "order_status": (1,),
+    "transition_order_status": ("out for delivery", 1, "in progress", "in progress"),
+    "finish_order_status": ("cancelled", 1, "cancelled", "delivered"),
+    "insert_user": ("user", "user@example.com", "hash"),
+    "get_reservation": (1,),
+    "reservation_version": ("2024-01-01",),
+    "day_reservations": ("2024-01-01",),
+    "claim_reservation_version": ("2024-01-01", 0),
+    "insert_reservation": ("guest", "2024-01-01", "19:00:00", 2),
+    "reservation_slot": (1,),
+    "delete_reservation": (1,),
+    "bump_reservation_version": ("2024-01-01",),
+    "debug_order_rows": (1,),
+    "debug_tracking_rows": (1,),
+    "recent_order_ids": (),
+    "order_sale_lines": (1,),
+    "sales_days": ("2024-01-01", "2024-01-31"),
+    "sales_top_items": ("2024-01-01", "2024-01-31", 10),
+}
+# Read the whole table on purpose
+EXPECTED_SCANS = {"menu_items"}
+
+
+def _hot_queries():
+    """(name, sql, params) for every statement db_helper runs per request or per order batch.
+
+    Statements whose text depends on their arguments come from the same
+    builders db_helper executes, so the plans checked are the plans run.
+    rebuild_sales_rollups is left out; it scans both tables by design.
+    """
+    backend = db_helper.backend
+    queries = [(statement.name, statement.sql, _SAMPLE_PARAMS[statement.name])
+               for statement in statements.REGISTRY.values()]
+    placed_at = "2024-01-01 12:00:00"
+    queries += [
+        ("get_tracked_order_ids", db_helper.tracked_order_ids_sql(2), (1, 2)),
+        ("insert_order_lines", db_helper.insert_order_lines_sql(2), (1, 1, 2, 10, 1, 2, 1, 5)),
+        ("insert_order_tracking_rows", db_helper.insert_order_tracking_sql(2),
+         (1, "in progress", placed_at, 2, "in progress", placed_at)),
+        ("reserve_order_ids", db_helper.SEED_ORDER_ID_SEQUENCE, ()),
+        ("reserve_order_ids", backend.advance_sequence_sql, (20, "orders")),
+    ]
+    if backend.read_sequence_sql is not None:
+        queries.append(("reserve_order_ids", backend.read_sequence_sql, ("orders",)))
+    for rollups in db_helper.SALES_ROLLUPS.values():
+        for table, keys, counters in rollups:
+            sample = ("2024-01-01", 1)[:len(keys)] + (1, 10)
+            queries.append(("add_sales", backend.accumulate(table, keys, counters, 1), sample))
+    queries.append(("export orders", *db_helper.order_export_query(date(2024, 1, 1), date(2024, 1, 31), "delivered")))
+    queries.append(("export reservations", *db_helper.reservation_export_query(date(2024, 1, 1), date(2024, 1, 31))))
+    return queries
+
+
+HOT_QUERIES = _hot_queries()
+
+
+def check_query_plans():
+    """EXPLAIN each hot statement and warn about full table scans; returns the offending statements"""
+    backend = db_helper.backend
+    offenders = []
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            for name, sql, params in HOT_QUERIES:
+                try:
+                    tables = backend.full_table_scans(cursor, sql, params)
+                except db_helper.DB_ERRORS as err:
+                    logger.warning("Could not EXPLAIN %s: %s", name, err)
+                    continue
+                if tables and name not in EXPECTED_SCANS:
+                    logger.warning("%s does a full table scan of %s: %s", name, ', '.join(tables), sql)
+                    offenders.append((name, sql))
+    return offenders
+
+
+def bootstrap():
+    """Bring the schema up to date, then check the hot statements' query plans"""
+    version = migrate()
+    logger.info("Database schema at version %s", version)
+    return check_query_plans()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    bootstrap()
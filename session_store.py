@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "10000"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+
+class SessionStore(ABC):
+    """Storage for in-progress carts, keyed by Dialogflow session id.
+
+    ``get`` returns a cart the caller may modify; changes are only kept once
+    they are written back with ``set``. Async handlers use ``aget``, ``aset``
+    and ``adelete``, which move the call off the event loop for stores whose
+    methods can block.
+    """
+
+    # True when get/set/delete can block on I/O or on another process
+    blocking = False
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def set(self, session_id: str, order: dict):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def evictions(self) -> int:
+        ...
+
+    def stats(self):
+        return {"size": self.size(), "evictions": self.evictions}
+
+    async def _call(self, method, *args):
+        if self.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def aget(self, session_id: str) -> Optional[dict]:
+        return await self._call(self.get, session_id)
+
+    async def aset(self, session_id: str, order: dict):
+        await self._call(self.set, session_id, order)
+
+    async def adelete(self, session_id: str):
+        await self._call(self.delete, session_id)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU store that also drops carts idle for longer than ``ttl``"""
+
+    def __init__(self, max_size=SESSION_MAX_SIZE, ttl=SESSION_TTL):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get(self, session_id):
+        return self._cache.get(session_id)
+
+    def set(self, session_id, order):
+        self._cache.set(session_id, order)
+
+    def delete(self, session_id):
+        self._cache.pop(session_id)
+
+    def size(self):
+        self._cache.purge_expired()
+        return len(self._cache)
+
+    @property
+    def evictions(self):
+        return self._cache.evictions
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared by every worker process on the host through one SQLite file.
+
+    Expired carts are skipped on read and purged, together with the oldest
+    carts beyond ``max_size``, every ``purge_every`` writes.
+    """
+
+    # Calls take a lock and may wait out the 5 s busy timeout behind other workers
+    blocking = True
+
+    def __init__(self, path=SESSION_DB_PATH, max_size=SESSION_MAX_SIZE, ttl=SESSION_TTL, purge_every=500):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                cart TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cart FROM sessions WHERE session_id = ? AND expires_at > ?",
+                                     (session_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, session_id, order):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions (session_id, cart, expires_at) VALUES (?, ?, ?)",
+                               (session_id, json.dumps(order), time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?",
+                                      (time.time(),)).fetchone()[0]
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    def _purge(self):
+        expired = self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+        overflow = self._conn.execute("""
+            DELETE FROM sessions WHERE session_id IN (
+                SELECT session_id FROM sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_size,)).rowcount
+        self._evictions += expired + overflow
+        if expired or overflow:
+            logger.info("Session store evicted %s expired and %s overflow carts", expired, overflow)
+
+
+def create_session_store(kind=SESSION_STORE) -> SessionStore:
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown session store: {kind}")
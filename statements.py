@@ -0,0 +1,96 @@
+"""The fixed statements db_helper runs on its hot paths, declared once.
+
+db_helper executes each registered statement as a server-side prepared
+statement on a cursor cached per pooled connection (see
+``db_helper.query_all`` and ``db_helper.run_statement``). mysql.connector
+prepares again only when a cursor is given a different SQL string object.
+Reusing the registered string therefore parses each statement once per
+connection and brings results back over the binary protocol.
+
+Statements whose text depends on their arguments stay client-side
+interpolated. These are the multi-row INSERTs, the IN lists and the
+dialect-specific INSERT IGNOREs.
+"""
+from typing import Dict, NamedTuple
+
+
+class Statement(NamedTuple):
+    name: str
+    sql: str
+    # Rows come back as dicts instead of tuples
+    dictionary: bool = False
+
+
+REGISTRY: Dict[str, Statement] = {}
+
+
+def register(name, sql, dictionary=False) -> Statement:
+    if name in REGISTRY:
+        raise ValueError(f"Statement {name} is already registered")
+    statement = Statement(name, " ".join(sql.split()), dictionary)
+    REGISTRY[name] = statement
+    return statement
+
+
+MENU_ITEMS = register("menu_items", "SELECT item_id, name, price FROM food_items")
+UPDATE_MENU_PRICE = register("update_menu_price", "UPDATE food_items SET price = %s WHERE name = %s")
+NEXT_ITEM_ID = register("next_item_id", "SELECT IFNULL(MAX(item_id), 0) + 1 FROM food_items")
+
+ORDER_TOTAL = register("order_total", "SELECT SUM(total_price) FROM orders WHERE order_id = %s")
+ORDER_STATUS = register("order_status", "SELECT status FROM order_tracking WHERE order_id = %s")
+# Stored statuses are compared lowercased, as older rows are not always in canonical case.
+# A transition with one source status passes it twice
+TRANSITION_ORDER_STATUS = register(
+    "transition_order_status",
+    "UPDATE order_tracking SET status = %s WHERE order_id = %s AND LOWER(status) IN (%s, %s)")
+# Moves an order out of any status except the two final ones, which are passed in
+FINISH_ORDER_STATUS = register(
+    "finish_order_status",
+    "UPDATE order_tracking SET status = %s WHERE order_id = %s AND LOWER(status) NOT IN (%s, %s)")
+
+INSERT_USER = register("insert_user", "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)")
+
+GET_RESERVATION = register("get_reservation", "SELECT * FROM reservations WHERE reservation_id = %s",
+                           dictionary=True)
+RESERVATION_VERSION = register(
+    "reservation_version", "SELECT version FROM reservation_versions WHERE reservation_date = %s")
+DAY_RESERVATIONS = register(
+    "day_reservations", "SELECT time, party_size FROM reservations WHERE reservation_date = %s")
+CLAIM_RESERVATION_VERSION = register(
+    "claim_reservation_version",
+    "UPDATE reservation_versions SET version = version + 1 WHERE reservation_date = %s AND version = %s")
+INSERT_RESERVATION = register(
+    "insert_reservation",
+    "INSERT INTO reservations (customer_name, reservation_date, time, party_size) VALUES (%s, %s, %s, %s)")
+RESERVATION_SLOT = register(
+    "reservation_slot", "SELECT reservation_date, time, party_size FROM reservations WHERE reservation_id = %s")
+DELETE_RESERVATION = register("delete_reservation", "DELETE FROM reservations WHERE reservation_id = %s")
+BUMP_RESERVATION_VERSION = register(
+    "bump_reservation_version", "UPDATE reservation_versions SET version = version + 1 WHERE reservation_date = %s")
+
+# Admin debugging: both tables' rows for one order, and the latest order IDs
+DEBUG_ORDER_ROWS = register("debug_order_rows", "SELECT * FROM orders WHERE order_id = %s")
+DEBUG_TRACKING_ROWS = register("debug_tracking_rows", "SELECT * FROM order_tracking WHERE order_id = %s")
+RECENT_ORDER_IDS = register("recent_order_ids", "SELECT DISTINCT order_id FROM orders ORDER BY order_id DESC LIMIT 10")
+
+# Placement time plus one row per line (NULL item for an order without lines)
+ORDER_SALE_LINES = register(
+    "order_sale_lines",
+    """SELECT t.placed_at, o.item_id, o.quantity, o.total_price
+       FROM order_tracking t LEFT JOIN orders o ON o.order_id = t.order_id
+       WHERE t.order_id = %s""")
+SALES_DAYS = register(
+    "sales_days",
+    """SELECT sales_date, orders, revenue, cancelled_orders, cancelled_revenue
+       FROM sales_daily WHERE sales_date >= %s AND sales_date <= %s ORDER BY sales_date""",
+    dictionary=True)
+SALES_TOP_ITEMS = register(
+    "sales_top_items",
+    """SELECT s.item_id, f.name, SUM(s.quantity) AS quantity, SUM(s.revenue) AS revenue,
+              SUM(s.cancelled_quantity) AS cancelled_quantity, SUM(s.cancelled_revenue) AS cancelled_revenue
+       FROM sales_daily_items s LEFT JOIN food_items f ON f.item_id = s.item_id
+       WHERE s.sales_date >= %s AND s.sales_date <= %s
+       GROUP BY s.item_id, f.name
+       ORDER BY quantity DESC, s.item_id
+       LIMIT %s""",
+    dictionary=True)
@@ -0,0 +1,331 @@
+"""Storage backends behind db_helper: MySQL, or an embedded SQLite file chosen with DB_BACKEND.
+
+The repository layer is db_helper itself. It has one function per
+operation on orders, order_tracking, food_items, reservations and users,
+and the fixed statements live in statements.py. That SQL is portable
+between the two databases once placeholders are translated. So a backend
+does not carry its own copy of every query. It only supplies connections
+that speak mysql.connector's cursor API, and the few dialect pieces that
+really differ: upserts, sequences, catalog lookups and EXPLAIN. A new
+backend implements StorageBackend, and the domain functions work on it
+unchanged.
+"""
+import datetime
+import functools
+import logging
+import os
+import sqlite3
+from decimal import Decimal
+
+try:
+    import mysql.connector
+except ImportError:  # only needed for the MySQL backend
+    mysql = None
+
+logger = logging.getLogger(__name__)
+
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "mr_ray.db")
+
+
+class StorageError(Exception):
+    """Raised by db_helper for data problems that are not driver errors"""
+
+
+class StorageBackend:
+    """Connection factory plus the few SQL dialect details db_helper cannot share.
+
+    db_helper writes its statements once, with ``%s`` placeholders, against the
+    connection and cursor API of mysql.connector. Each backend hands out
+    connections that speak that API and fills in the dialect-specific pieces
+    below.
+    """
+
+    name = None
+    # Exception types a failed statement can raise
+    errors = ()
+    # Raised when a unique or primary key constraint rejects a write
+    integrity_error = ()
+    insert_ignore = "INSERT IGNORE"
+    autoincrement_primary_key = "INT AUTO_INCREMENT PRIMARY KEY"
+
+    def connect(self):
+        raise NotImplementedError
+
+    def ping(self, cnx) -> bool:
+        raise NotImplementedError
+
+    def prepared_cursor(self, cnx, dictionary=False):
+        """A cursor for running one statement repeatedly; backends that can prepare it server-side do"""
+        return cnx.cursor(dictionary=dictionary)
+
+    def accumulate(self, table, keys, counters, rows) -> str:
+        """INSERT of ``rows`` rows into ``table`` that adds ``counters`` onto the rows whose ``keys`` already exist"""
+        raise NotImplementedError
+
+    # Statements reserve_sequence runs, with (count, name) and (name,) as parameters
+    advance_sequence_sql = None
+    read_sequence_sql = None
+
+    def reserve_sequence(self, cursor, name, count) -> int:
+        """Advance sequence ``name`` by ``count`` inside the current transaction and return its new value"""
+        raise NotImplementedError
+
+    def index_exists(self, cursor, table, index) -> bool:
+        raise NotImplementedError
+
+    def column_exists(self, cursor, table, column) -> bool:
+        raise NotImplementedError
+
+    def leading_index_columns(self, cursor, table) -> set:
+        """Columns that are the first key part of some index on ``table``, primary key included"""
+        raise NotImplementedError
+
+    def full_table_scans(self, cursor, sql, params) -> list:
+        """Return the tables ``sql`` would read with a full scan, according to the query planner"""
+        raise NotImplementedError
+
+
+class MySQLBackend(StorageBackend):
+    name = "mysql"
+    # LAST_INSERT_ID(expr) hands the new counter value back in the OK packet
+    advance_sequence_sql = "UPDATE id_sequences SET next_value = LAST_INSERT_ID(next_value + %s) WHERE name = %s"
+
+    def __init__(self, config):
+        if mysql is None:
+            raise StorageError("mysql-connector-python is required for DB_BACKEND=mysql")
+        self.config = config
+        self.errors = (mysql.connector.Error,)
+        self.integrity_error = (mysql.connector.IntegrityError,)
+
+    def connect(self):
+        try:
+            return mysql.connector.connect(autocommit=False, **self.config)
+        except mysql.connector.Error as err:
+            logger.error("Database connection failed: %s", err)
+            raise
+
+    def ping(self, cnx):
+        return cnx.is_connected()
+
+    def prepared_cursor(self, cnx, dictionary=False):
+        # Prepared cursors are unbuffered; db_helper reads every row before the next statement
+        return cnx.cursor(prepared=True, dictionary=dictionary)
+
+    def accumulate(self, table, keys, counters, rows):
+        values = ", ".join(["(" + ", ".join(["%s"] * (len(keys) + len(counters))) + ")"] * rows)
+        updates = ", ".join(f"{column} = {column} + VALUES({column})" for column in counters)
+        return (f"INSERT INTO {table} ({', '.join(keys + counters)}) VALUES {values} "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+    def reserve_sequence(self, cursor, name, count):
+        cursor.execute(self.advance_sequence_sql, (count, name))
+        if cursor.rowcount != 1:
+            raise StorageError(f"Sequence {name} is missing")
+        return cursor.lastrowid
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, index))
+        return cursor.fetchone()[0] > 0
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        return cursor.fetchone()[0] > 0
+
+    def leading_index_columns(self, cursor, table):
+        cursor.execute("""
+            SELECT column_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND seq_in_index = 1
+        """, (table,))
+        return {row[0] for row in cursor.fetchall()}
+
+    def full_table_scans(self, cursor, sql, params):
+        cursor.execute(f"EXPLAIN {sql}", params)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # The target row of an INSERT always shows type ALL without reading the table
+        return [row["table"] for row in rows if row.get("type") == "ALL" and row.get("select_type") != "INSERT"]
+
+
+@functools.lru_cache(maxsize=512)
+def _to_qmark(sql):
+    return sql.replace("%s", "?")
+
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(datetime.time, lambda value: value.isoformat())
+
+
+class _SQLiteCursor:
+    """Cursor with the subset of the mysql.connector cursor API db_helper relies on"""
+
+    def __init__(self, raw, dictionary=False):
+        self._raw = raw
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        self._raw.execute(_to_qmark(sql), tuple(params) if params else ())
+
+    def executemany(self, sql, seq_of_params):
+        self._raw.executemany(_to_qmark(sql), seq_of_params)
+
+    def _convert(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._raw.description, row)}
+
+    def fetchone(self):
+        return self._convert(self._raw.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._convert(row) for row in self._raw.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._raw.fetchall()]
+
+    def __iter__(self):
+        for row in self._raw:
+            yield self._convert(row)
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def close(self):
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _SQLiteConnection:
+    """sqlite3 connection exposing the mysql.connector connection methods db_helper uses"""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, dictionary=False, **kwargs):
+        return _SQLiteCursor(self._raw.cursor(), dictionary=dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def is_connected(self):
+        try:
+            self._raw.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        self._raw.close()
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded backend for local development, tests, benchmarks and single-node deployments"""
+
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+    integrity_error = (sqlite3.IntegrityError,)
+    insert_ignore = "INSERT OR IGNORE"
+    autoincrement_primary_key = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    advance_sequence_sql = "UPDATE id_sequences SET next_value = next_value + %s WHERE name = %s"
+    read_sequence_sql = "SELECT next_value FROM id_sequences WHERE name = %s"
+
+    def __init__(self, path, busy_timeout=5.0, cached_statements=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+
+    def connect(self):
+        # sqlite3 keeps compiled statements per connection, so the fixed query
+        # set is prepared once and reused for the life of the pooled connection
+        raw = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                              cached_statements=self.cached_statements)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        return _SQLiteConnection(raw)
+
+    def ping(self, cnx):
+        return cnx.is_connected()
+
+    def accumulate(self, table, keys, counters, rows):
+        values = ", ".join(["(" + ", ".join(["%s"] * (len(keys) + len(counters))) + ")"] * rows)
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in counters)
+        return (f"INSERT INTO {table} ({', '.join(keys + counters)}) VALUES {values} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+
+    def reserve_sequence(self, cursor, name, count):
+        # The UPDATE takes SQLite's write lock, so no other writer can move the
+        # counter before this transaction reads it back
+        cursor.execute(self.advance_sequence_sql, (count, name))
+        if cursor.rowcount != 1:
+            raise StorageError(f"Sequence {name} is missing")
+        cursor.execute(self.read_sequence_sql, (name,))
+        return cursor.fetchone()[0]
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+                       (table, index))
+        return cursor.fetchone()[0] > 0
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+
+    def leading_index_columns(self, cursor, table):
+        # An INTEGER PRIMARY KEY is the rowid itself and has no separate index
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = {row[1] for row in cursor.fetchall() if row[5] == 1 and row[2].upper() == "INTEGER"}
+        cursor.execute(f"PRAGMA index_list({table})")
+        for index in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"PRAGMA index_info({index})")
+            for seqno, _, column in cursor.fetchall():
+                if seqno == 0 and column is not None:
+                    columns.add(column)
+        return columns
+
+    def full_table_scans(self, cursor, sql, params):
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        scans = []
+        for row in cursor.fetchall():
+            detail = row[-1]
+            # "SCAN t" reads every row; "SCAN t USING [COVERING] INDEX" walks an index instead
+            # "SCAN n CONSTANT ROWS" is the VALUES list of an INSERT
+            if detail.startswith("SCAN ") and " INDEX " not in f"{detail} " and "CONSTANT ROW" not in detail:
+                scans.append(detail.split()[1])
+        return scans
+
+
+def create_backend(kind=DB_BACKEND, mysql_config=None) -> StorageBackend:
+    if kind == "mysql":
+        return MySQLBackend(mysql_config or {})
+    if kind == "sqlite":
+        return SQLiteBackend(SQLITE_PATH)
+    raise ValueError(f"Unknown DB_BACKEND: {kind}")
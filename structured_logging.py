@@ -0,0 +1,142 @@
+"""Logging pipeline that keeps formatting and I/O off the request path.
+
+Records are tagged with the current request id, session id and intent,
+then handed to a bounded in-memory queue. A QueueListener thread formats
+them (JSON by default) and writes them out. Message arguments are
+interpolated on that thread too, so callers should log with ``%s`` style
+arguments rather than f-strings. DEBUG records are sampled per request and
+rate limited, and records that do not fit in the queue are dropped and
+counted instead of blocking the caller.
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+
+import orjson
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of requests whose DEBUG records are kept, and the most DEBUG records written per second
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+LOG_DEBUG_RATE_LIMIT = float(os.getenv("LOG_DEBUG_RATE_LIMIT", "50"))
+
+request_id = contextvars.ContextVar("request_id", default=None)
+session_id = contextvars.ContextVar("session_id", default=None)
+intent = contextvars.ContextVar("intent", default=None)
+
+_CONTEXT = (("request_id", request_id), ("session_id", session_id), ("intent", intent))
+
+dropped = 0
+_listener = None
+
+
+class DebugSampler(logging.Filter):
+    """Pass every record above DEBUG; pass DEBUG records for a sampled share of requests, within a rate limit"""
+
+    def __init__(self, rate=LOG_DEBUG_SAMPLE_RATE, per_second=LOG_DEBUG_RATE_LIMIT):
+        super().__init__()
+        self.rate = rate
+        self.per_second = per_second
+        self._tokens = per_second
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        # Keyed on the request id so a sampled request keeps all of its DEBUG lines
+        key = getattr(record, "request_id", None)
+        sample = zlib.crc32(key.encode()) % 10000 / 10000 if key else random.random()
+        if sample >= self.rate:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.per_second, self._tokens + (now - self._refilled) * self.per_second)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        return True
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Tags records with the request context and enqueues them without formatting"""
+
+    def prepare(self, record):
+        for name, var in _CONTEXT:
+            if not hasattr(record, name):
+                setattr(record, name, var.get())
+        return record
+
+    def handle(self, record):
+        # Context must be attached before the sampler reads the request id
+        self.prepare(record)
+        return super().handle(record)
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name, _ in _CONTEXT:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s %(intent)s] %(message)s")
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Route the root logger through the queue; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler = ContextQueueHandler(records)
+    handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
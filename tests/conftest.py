@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The modules under test read their configuration at import time
+_data = tempfile.mkdtemp(prefix="mr-ray-tests-")
+os.environ.setdefault("DB_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(_data, "mr_ray.db"))
+os.environ.setdefault("ORDER_QUEUE_PATH", os.path.join(_data, "order_queue.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
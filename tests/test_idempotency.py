@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db_helper
+import main
+import schema
+from idempotency import IdempotencyCache
+
+COMPLETE = "order.complete - context: ongoing-order"
+ADD = "order.add - context: ongoing-order"
+
+
+@pytest.fixture(scope="module")
+def client():
+    schema.migrate()
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            cursor.execute("REPLACE INTO food_items (item_id, name, price) VALUES (%s, %s, %s)", (1, "Pizza", 8.00))
+        cnx.commit()
+    db_helper.menu_cache.invalidate()
+    # No lifespan: the queue worker stays stopped, so placed orders stay in the journal where they can be counted
+    return TestClient(main.app)
+
+
+def webhook(client, intent, parameters, session, response_id):
+    response = client.post("/", json={
+        "responseId": response_id,
+        "queryResult": {
+            "intent": {"displayName": intent},
+            "parameters": parameters,
+            "outputContexts": [{"name": f"projects/test/agent/sessions/{session}/contexts/ongoing-order"}],
+        },
+    })
+    assert response.status_code == 200
+    return response.json()["fulfillmentText"]
+
+
+def test_duplicate_key_returns_the_stored_result():
+    cache = IdempotencyCache(max_size=10, ttl=60)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        return f"reply {len(calls)}"
+
+    async def scenario():
+        first = await cache.run(("r1", "s1"), produce)
+        again = await cache.run(("r1", "s1"), produce)
+        other = await cache.run(("r1", "s2"), produce)
+        return first, again, other
+
+    assert asyncio.run(scenario()) == ("reply 1", "reply 1", "reply 2")
+    assert len(calls) == 2
+    assert cache.hits == 1
+
+
+def test_duplicate_waits_for_the_call_in_flight():
+    cache = IdempotencyCache(max_size=10, ttl=60)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "placed"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.run("key", produce) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["placed"] * 3
+    assert len(calls) == 1
+    assert cache.hits == 2
+
+
+def test_failed_call_is_not_stored():
+    cache = IdempotencyCache(max_size=10, ttl=60)
+
+    async def fail():
+        raise RuntimeError("database down")
+
+    async def succeed():
+        return "placed"
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await cache.run("key", fail)
+        assert len(cache) == 0
+        return await cache.run("key", succeed)
+
+    assert asyncio.run(scenario()) == "placed"
+    assert cache.hits == 0
+
+
+def test_retried_complete_order_places_one_order(client):
+    session = "retry-session"
+    assert "Pizza" in webhook(client, ADD, {"food-item": ["Pizza"], "number": [2]}, session, "add-1")
+
+    depth = main.order_queue.depth()
+    first = webhook(client, COMPLETE, {}, session, "complete-1")
+    # Dialogflow retries a slow webhook with the same responseId
+    retried = webhook(client, COMPLETE, {}, session, "complete-1")
+
+    assert "Order ID: #" in first
+    assert retried == first
+    assert main.order_queue.depth() == depth + 1
+
+    # A new turn is not a retry: the cart is gone, so nothing more is placed
+    assert "trouble finding your order" in webhook(client, COMPLETE, {}, session, "complete-2")
+    assert main.order_queue.depth() == depth + 1
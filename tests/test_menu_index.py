@@ -0,0 +1,30 @@
+import pytest
+
+from menu_cache import MenuItem
+from menu_index import MenuIndex
+
+MENU = ["Pizza", "Samosa", "Biryani", "Mango Lassi", "Pav Bhaji", "Vada Pav", "Chole Bhature", "Masala Dosa"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return MenuIndex(MenuItem(item_id, name, 1) for item_id, name in enumerate(MENU, 1))
+
+
+@pytest.mark.parametrize("typed, expected", [
+    ("briyani", "Biryani"),
+    ("mnago lassi", "Mango Lassi"),
+    ("chole bahture", "Chole Bhature"),
+    ("masala dossa", "Masala Dosa"),
+    ("pav bhaaji", "Pav Bhaji"),
+    ("samosas", "Samosa"),
+    ("pizzas", "Pizza"),
+    ("Vada Pavs", "Vada Pav"),
+])
+def test_typos_resolve_to_the_menu_name(index, typed, expected):
+    assert index.resolve(typed).name == expected
+
+
+@pytest.mark.parametrize("typed", ["burger", "lassi mango chai", ""])
+def test_unrelated_names_do_not_resolve(index, typed):
+    assert index.resolve(typed) is None
@@ -0,0 +1,117 @@
+import sqlite3
+import time
+from decimal import Decimal
+
+from db_helper import PricedLine, PricedOrder
+from order_queue import OrderQueue
+
+
+class Writer:
+    """Records the orders it is handed; fails any batch holding an order ID in ``failing``"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+
+    def __call__(self, batch):
+        if any(order.order_id in self.failing for order in batch):
+            return {"error": "write failed"}
+        self.batches.append([order.order_id for order in batch])
+        return {"success": True}
+
+    @property
+    def order_ids(self):
+        return sorted(order_id for batch in self.batches for order_id in batch)
+
+
+def priced(quantity=1):
+    line = PricedLine(1, quantity, Decimal("8.00"), Decimal("8.00") * quantity)
+    return PricedOrder((line,), line.line_total, ())
+
+
+def journaled(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM order_journal WHERE dead = 0").fetchone()[0]
+
+
+def test_orders_journaled_before_a_crash_are_replayed(tmp_path):
+    path = str(tmp_path / "journal.db")
+    crashed = OrderQueue(Writer(), path=path)
+    crashed.enqueue(1, priced(2))
+    crashed.enqueue(2, priced())
+    # The process dies before its worker ever runs
+
+    writer = Writer()
+    queue = OrderQueue(writer, path=path, idle_wait=0.05)
+    queue.start()
+    try:
+        assert queue.flush(1, timeout=5) and queue.flush(2, timeout=5)
+    finally:
+        queue.stop()
+
+    assert writer.order_ids == [1, 2]
+    assert journaled(path) == 0
+    assert queue.depth() == 0
+
+
+def test_expired_claim_is_taken_over(tmp_path):
+    path = str(tmp_path / "journal.db")
+    crashed = OrderQueue(Writer(), path=path)
+    crashed.enqueue(1, priced())
+    # Claimed by a worker that dies before committing the batch
+    assert len(crashed._claim()) == 1
+
+    writer = Writer()
+    queue = OrderQueue(writer, path=path, lease=0.1)
+    assert queue.drain_once() == 0
+    time.sleep(0.15)
+    assert queue.drain_once() == 1
+    assert writer.order_ids == [1]
+    assert journaled(path) == 0
+
+
+def test_order_is_dead_lettered_after_max_attempts(tmp_path):
+    path = str(tmp_path / "journal.db")
+    writer = Writer(failing={1})
+    queue = OrderQueue(writer, path=path, max_attempts=3)
+    queue.enqueue(1, priced())
+
+    for _ in range(3):
+        assert queue.drain_once() == 0
+    assert queue.dead_orders == 1
+    assert queue.failed_batches == 3
+    assert queue.depth() == 0
+
+    # Dead orders stay in the journal but are never claimed again
+    writer.failing.clear()
+    assert queue.drain_once() == 0
+    assert writer.batches == []
+    assert queue.flush(1, timeout=0)
+
+
+def test_bad_order_does_not_block_the_rest_of_its_batch(tmp_path):
+    writer = Writer(failing={2})
+    queue = OrderQueue(writer, path=str(tmp_path / "journal.db"))
+    for order_id in (1, 2, 3):
+        queue.enqueue(order_id, priced())
+
+    assert queue.drain_once() == 2
+    assert writer.order_ids == [1, 3]
+    assert queue.depth() == 1
+    assert not queue.flush(2, timeout=0)
+
+
+def test_depth_follows_the_journal(tmp_path):
+    path = str(tmp_path / "journal.db")
+    queue = OrderQueue(Writer(), path=path, batch_size=2)
+    for order_id in (1, 2, 3):
+        queue.enqueue(order_id, priced())
+    assert queue.depth() == journaled(path) == 3
+
+    assert queue.drain_once() == 2
+    assert queue.depth() == journaled(path) == 1
+
+    # Orders journaled by another process are only counted once the journal is recounted
+    OrderQueue(Writer(), path=path).enqueue(4, priced())
+    assert queue.depth() == 1
+    assert queue._recount() == queue.depth() == journaled(path) == 2
@@ -0,0 +1,95 @@
+import time
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db_helper
+import main
+import schema
+from db_helper import PricedLine, PricedOrder
+from order_queue import QueuedOrder
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    schema.migrate()
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "test-token")
+    client = TestClient(main.app)
+
+    def change_status(order_id, status):
+        return client.post(f"/admin/orders/{order_id}/status", json={"status": status},
+                           headers={"X-Admin-Token": "test-token"})
+    return change_status
+
+
+def priced():
+    line = PricedLine(1, 2, Decimal("4.00"), Decimal("8.00"))
+    return PricedOrder((line,), line.line_total, ())
+
+
+def place_order(order_id):
+    assert "error" not in main.save_to_db([QueuedOrder(order_id, priced(), time.time())])
+
+
+def stored_status(order_id):
+    db_helper.order_status_cache.pop(order_id, None)
+    return db_helper.get_order_status(order_id)
+
+
+def test_second_cancel_is_refused():
+    place_order(720001)
+    assert db_helper.transition_order_status(720001, "cancelled") is True
+    assert db_helper.transition_order_status(720001, "cancelled") is False
+    assert stored_status(720001) == "cancelled"
+
+
+def test_cancel_after_delivery_is_refused():
+    place_order(720002)
+    assert db_helper.transition_order_status(720002, "delivered") is True
+    assert db_helper.transition_order_status(720002, "cancelled") is False
+    assert stored_status(720002) == "delivered"
+
+
+def test_status_case_does_not_matter():
+    place_order(720003)
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            cursor.execute("UPDATE order_tracking SET status = %s WHERE order_id = %s", ("In Progress", 720003))
+        cnx.commit()
+
+    assert db_helper.transition_order_status(720003, "out for delivery") is True
+    assert db_helper.transition_order_status(720003, "cancelled") is True
+
+
+def test_unknown_order_cannot_change():
+    assert db_helper.transition_order_status(729999, "cancelled") is False
+
+
+def test_admin_transition_conflict_is_409(admin):
+    place_order(720004)
+    assert admin(720004, "delivered").json() == {"order_id": 720004, "status": "delivered"}
+    assert admin(720004, "cancelled").status_code == 409
+    assert admin(720004, "out for delivery").status_code == 409
+    assert admin(720004, "lost").status_code == 400
+
+
+def test_admin_endpoint_needs_the_token(admin):
+    place_order(720005)
+    client = TestClient(main.app)
+    assert client.post("/admin/orders/720005/status", json={"status": "cancelled"}).status_code == 404
+    assert stored_status(720005) == "in progress"
+
+
+def test_order_still_in_the_journal_can_be_cancelled(admin):
+    main.order_queue.enqueue(720006, priced())
+    main.order_queue.start()
+    try:
+        assert admin(720006, "cancelled").status_code == 200
+    finally:
+        main.order_queue.stop()
+    assert stored_status(720006) == "cancelled"
@@ -0,0 +1,33 @@
+import datetime
+
+import pytest
+
+import reservation_engine
+import schema
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    schema.migrate()
+
+
+def test_off_boundary_sitting_claims_the_slot_it_ends_in():
+    engine = reservation_engine.ReservationEngine(capacity=40, slot_minutes=30, sitting_minutes=90)
+    day = datetime.date(2031, 3, 1)
+
+    # 19:15 + 90 minutes runs until 20:45, into the 20:30 slot
+    first = engine.book_reservation("First", day, datetime.time(19, 15), 40)
+    assert first.reservation_id is not None
+
+    second = engine.book_reservation("Second", day, datetime.time(20, 30), 40)
+    assert second.reservation_id is None
+    assert datetime.time(20, 30) not in second.alternatives
+    assert engine.is_free(day, datetime.time(21, 0), 40)
+
+
+def test_on_boundary_sittings_can_follow_each_other():
+    engine = reservation_engine.ReservationEngine(capacity=40, slot_minutes=30, sitting_minutes=90)
+    day = datetime.date(2031, 3, 2)
+
+    assert engine.book_reservation("First", day, datetime.time(19, 0), 40).reservation_id is not None
+    assert engine.book_reservation("Second", day, datetime.time(20, 30), 40).reservation_id is not None
@@ -0,0 +1,63 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import db_helper
+import main
+import schema
+from db_helper import PricedLine, PricedOrder
+from order_queue import QueuedOrder
+
+DAY = date(2031, 5, 4)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    schema.migrate()
+
+
+def priced(*lines):
+    lines = tuple(PricedLine(item_id, quantity, Decimal(price), Decimal(price) * quantity)
+                  for item_id, quantity, price in lines)
+    return PricedOrder(lines, sum(line.line_total for line in lines), ())
+
+
+def rollups():
+    """Both rollups for DAY, with amounts rounded so either backend compares equal"""
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            cursor.execute("SELECT orders, revenue, cancelled_orders, cancelled_revenue FROM sales_daily "
+                           "WHERE sales_date = %s", (DAY,))
+            daily = [tuple(round(float(value), 2) for value in row) for row in cursor.fetchall()]
+            cursor.execute("SELECT item_id, quantity, revenue, cancelled_quantity, cancelled_revenue "
+                           "FROM sales_daily_items WHERE sales_date = %s ORDER BY item_id", (DAY,))
+            items = [tuple(round(float(value), 2) for value in row) for row in cursor.fetchall()]
+    return daily, items
+
+
+def test_incremental_rollups_match_a_rebuild():
+    placed_at = datetime.combine(DAY, datetime.min.time()).replace(hour=12).timestamp()
+    batch = [
+        QueuedOrder(730001, priced((1, 2, "8.00"), (2, 1, "2.50")), placed_at),
+        QueuedOrder(730002, priced((2, 3, "2.50")), placed_at + 60),
+        QueuedOrder(730003, priced((1, 1, "8.00"), (3, 2, "6.50")), placed_at + 120),
+    ]
+    assert "error" not in main.save_to_db(batch[:2])
+    # A replayed batch must not count the orders it already committed
+    assert "error" not in main.save_to_db(batch)
+    assert db_helper.transition_order_status(730003, "cancelled") is True
+    # A refused cancel must not move the rollups
+    assert db_helper.transition_order_status(730003, "cancelled") is False
+
+    incremental = rollups()
+    assert incremental == (
+        [(3.0, 47.0, 1.0, 21.0)],
+        [(1.0, 3.0, 24.0, 1.0, 8.0), (2.0, 4.0, 10.0, 0.0, 0.0), (3.0, 2.0, 13.0, 2.0, 13.0)],
+    )
+
+    with db_helper.get_db_connection() as cnx:
+        with cnx.cursor() as cursor:
+            db_helper.rebuild_sales_rollups(cursor)
+        cnx.commit()
+    assert rollups() == incremental
@@ -0,0 +1,64 @@
+"""Dialogflow ES webhook request model and the JSON response class the webhook replies with.
+
+Dialogflow sends the whole detect-intent result on every turn, but the
+handlers only read the intent name, the parameters and the first output
+context. The models below declare just those fields, so pydantic validates
+the raw body in one pass and skips everything else.
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+import generic_helper
+
+
+class Intent(BaseModel):
+    displayName: str
+
+
+class OutputContext(BaseModel):
+    name: str
+
+
+class QueryResult(BaseModel):
+    intent: Intent
+    parameters: Dict[str, Any] = {}
+    outputContexts: List[OutputContext] = []
+
+
+class WebhookRequest(BaseModel):
+    # Unique per detect-intent call; Dialogflow reuses it when it retries a slow webhook
+    responseId: Optional[str] = None
+    queryResult: QueryResult
+
+    @property
+    def intent(self) -> str:
+        return self.queryResult.intent.displayName
+
+    @property
+    def parameters(self) -> dict:
+        return self.queryResult.parameters
+
+    @property
+    def session_id(self) -> Optional[str]:
+        """Session path taken from the first output context, or None when Dialogflow sent none"""
+        contexts = self.queryResult.outputContexts
+        if not contexts:
+            return None
+        return generic_helper.extract_session_id(contexts[0].name)
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default)